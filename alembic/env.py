@@ -5,12 +5,17 @@ from sqlalchemy import pool
 
 from alembic import context
 
+from database import SQLALCHEMY_DATABASE_URL
 from models import Base
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# Migrate the database the app is configured for rather than the one in
+# alembic.ini, so the container can upgrade its own database on start.
+config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL.replace("%", "%%"))
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -0,0 +1,78 @@
+"""Align schema with models and index todos for its query patterns
+
+Revision ID: 2de777deeb03
+Revises: 7247a9478096
+Create Date: 2026-10-17 15:40:07.962315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2de777deeb03'
+down_revision: Union[str, None] = '7247a9478096'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TODO_INDEXES = {
+    'ix_todos_creator_id_id': ['creator_id', 'id'],
+    'ix_todos_creator_id_start_date_end_date': ['creator_id', 'start_date', 'end_date'],
+    'ix_todos_end_date': ['end_date'],
+}
+
+
+def upgrade() -> None:
+    # Databases built by the initial migration still have owner_id and the
+    # short column lengths, while those built by metadata.create_all already
+    # match models.py, so only apply what is actually missing.
+    inspector = sa.inspect(op.get_bind())
+    todo_columns = {column['name'] for column in inspector.get_columns('todos')}
+    todo_indexes = {index['name'] for index in inspector.get_indexes('todos')}
+    group_columns = {column['name'] for column in inspector.get_columns('groups')}
+
+    with op.batch_alter_table('todos') as batch_op:
+        if 'owner_id' in todo_columns:
+            batch_op.alter_column('owner_id', new_column_name='creator_id',
+                                  existing_type=sa.Integer(), existing_nullable=True)
+        batch_op.alter_column('title', existing_type=sa.String(length=20),
+                              type_=sa.String(length=255), existing_nullable=True)
+    if 'ix_todos_title' in todo_indexes:
+        op.drop_index('ix_todos_title', table_name='todos')
+    for name, columns in TODO_INDEXES.items():
+        if name not in todo_indexes:
+            op.create_index(name, 'todos', columns, unique=False)
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('username', existing_type=sa.String(length=10),
+                              type_=sa.String(length=255), existing_nullable=True)
+
+    with op.batch_alter_table('groups') as batch_op:
+        batch_op.alter_column('name', existing_type=sa.String(length=50),
+                              type_=sa.String(length=255), existing_nullable=True)
+        if 'creator_id' not in group_columns:
+            batch_op.add_column(sa.Column('creator_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_groups_creator_id_users', 'users', ['creator_id'], ['id'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('groups') as batch_op:
+        batch_op.drop_constraint('fk_groups_creator_id_users', type_='foreignkey')
+        batch_op.drop_column('creator_id')
+        batch_op.alter_column('name', existing_type=sa.String(length=255),
+                              type_=sa.String(length=50), existing_nullable=True)
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('username', existing_type=sa.String(length=255),
+                              type_=sa.String(length=10), existing_nullable=True)
+
+    for name in TODO_INDEXES:
+        op.drop_index(name, table_name='todos')
+    op.create_index(op.f('ix_todos_title'), 'todos', ['title'], unique=False)
+    with op.batch_alter_table('todos') as batch_op:
+        batch_op.alter_column('title', existing_type=sa.String(length=255),
+                              type_=sa.String(length=20), existing_nullable=True)
+        batch_op.alter_column('creator_id', new_column_name='owner_id',
+                              existing_type=sa.Integer(), existing_nullable=True)
@@ -0,0 +1,40 @@
+"""Add member_progress
+
+Revision ID: 3c7d95e1f0a2
+Revises: 9e4f2a6c81b0
+Create Date: 2026-10-17 20:26:48.771930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c7d95e1f0a2'
+down_revision: Union[str, None] = '9e4f2a6c81b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # May predate this revision, made by create_all on an older build's
+    # startup; the progress job keeps whatever rows it has current.
+    if sa.inspect(op.get_bind()).has_table('member_progress'):
+        return
+    op.create_table('member_progress',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('window_start', sa.Date(), nullable=False),
+    sa.Column('window_end', sa.Date(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.Column('missed', sa.Integer(), nullable=False),
+    sa.Column('open', sa.Integer(), nullable=False),
+    sa.Column('streak', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('member_progress')
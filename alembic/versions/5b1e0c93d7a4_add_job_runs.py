@@ -0,0 +1,42 @@
+"""Add job_runs
+
+Revision ID: 5b1e0c93d7a4
+Revises: 2de777deeb03
+Create Date: 2026-10-17 19:02:31.540871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e0c93d7a4'
+down_revision: Union[str, None] = '2de777deeb03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # An app that started on this code before the upgrade already made
+    # job_runs through create_all and has been claiming jobs in it.
+    if sa.inspect(op.get_bind()).has_table('job_runs'):
+        return
+    op.create_table('job_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job', sa.String(length=100), nullable=False),
+    sa.Column('scheduled_for', sa.DateTime(), nullable=False),
+    sa.Column('owner', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('rows', sa.Integer(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('job', 'scheduled_for', name='uq_job_runs_job_scheduled_for')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('job_runs')
@@ -0,0 +1,63 @@
+"""Add sync versions and tombstones
+
+Revision ID: 6a8e3f0d2c17
+Revises: d41a7c2e9b35
+Create Date: 2026-10-17 22:03:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a8e3f0d2c17'
+down_revision: Union[str, None] = 'd41a7c2e9b35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing rows start at version 0 and reach clients through their first
+    # full sync, which has no `since`.
+    op.add_column('todos', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('groups', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('group_membership', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+    op.create_index('ix_todos_creator_id_version', 'todos', ['creator_id', 'version'], unique=False)
+    op.create_index('ix_group_membership_group_id_version', 'group_membership', ['group_id', 'version'], unique=False)
+    # Each sync table is skipped if an older build's create_all already made
+    # it. A clock made that way has no row; sync.next_version seeds one.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('sync_clock'):
+        op.create_table('sync_clock',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.execute(sa.text('INSERT INTO sync_clock (id, version) VALUES (1, 0)'))
+    if not inspector.has_table('sync_tombstones'):
+        op.create_table('sync_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_sync_tombstones_user_id_version', 'sync_tombstones', ['user_id', 'version'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sync_tombstones_user_id_version', table_name='sync_tombstones')
+    op.drop_table('sync_tombstones')
+    op.drop_table('sync_clock')
+    op.drop_index('ix_group_membership_group_id_version', table_name='group_membership')
+    op.drop_index('ix_todos_creator_id_version', table_name='todos')
+    with op.batch_alter_table('group_membership') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('groups') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('todos') as batch_op:
+        batch_op.drop_column('version')
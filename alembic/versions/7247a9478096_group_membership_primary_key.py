@@ -0,0 +1,54 @@
+"""Add primary key and reverse index to group_membership
+
+Revision ID: 7247a9478096
+Revises: c38f7800a030
+Create Date: 2026-10-17 13:02:51.540118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7247a9478096'
+down_revision: Union[str, None] = 'c38f7800a030'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_membership_table(name, primary_key):
+    op.create_table(name,
+    sa.Column('user_id', sa.Integer(), nullable=not primary_key),
+    sa.Column('group_id', sa.Integer(), nullable=not primary_key),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    *([sa.PrimaryKeyConstraint('user_id', 'group_id')] if primary_key else [])
+    )
+
+
+def upgrade() -> None:
+    # group_membership was only ever created by metadata.create_all, so it may
+    # be missing; otherwise rebuild it, dropping the duplicate rows that
+    # repeated joins used to insert.
+    if not sa.inspect(op.get_bind()).has_table('group_membership'):
+        _create_membership_table('group_membership', primary_key=True)
+    else:
+        _create_membership_table('group_membership_new', primary_key=True)
+        op.execute(
+            'INSERT INTO group_membership_new (user_id, group_id) '
+            'SELECT DISTINCT user_id, group_id FROM group_membership '
+            'WHERE user_id IS NOT NULL AND group_id IS NOT NULL'
+        )
+        op.drop_table('group_membership')
+        op.rename_table('group_membership_new', 'group_membership')
+    op.create_index('ix_group_membership_group_id_user_id', 'group_membership', ['group_id', 'user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_group_membership_group_id_user_id', table_name='group_membership')
+    _create_membership_table('group_membership_old', primary_key=False)
+    op.execute('INSERT INTO group_membership_old (user_id, group_id) SELECT user_id, group_id FROM group_membership')
+    op.drop_table('group_membership')
+    op.rename_table('group_membership_old', 'group_membership')
@@ -0,0 +1,34 @@
+"""Add users.timezone and users.rolled_over_on
+
+Revision ID: 9e4f2a6c81b0
+Revises: 5b1e0c93d7a4
+Create Date: 2026-10-17 19:41:12.305118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4f2a6c81b0'
+down_revision: Union[str, None] = '5b1e0c93d7a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('timezone', sa.String(length=64), nullable=False, server_default='UTC'))
+    op.add_column('users', sa.Column('rolled_over_on', sa.Date(), nullable=True))
+    # Existing users were already rolled over by the old global midnight job;
+    # without this the first run would reset their todos in the middle of the day.
+    op.execute(sa.text('UPDATE users SET rolled_over_on = CURRENT_DATE'))
+    op.create_index('ix_users_timezone_rolled_over_on', 'users', ['timezone', 'rolled_over_on'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_timezone_rolled_over_on', table_name='users')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('rolled_over_on')
+        batch_op.drop_column('timezone')
@@ -0,0 +1,41 @@
+"""Add calendar_days
+
+Revision ID: c38f7800a030
+Revises: cbd8c10c9ff9
+Create Date: 2026-10-17 10:12:43.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c38f7800a030'
+down_revision: Union[str, None] = 'cbd8c10c9ff9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Builds that still ran create_all on import may have made calendar_days,
+    # index included, before anyone ran this. Such a table is already right.
+    if sa.inspect(op.get_bind()).has_table('calendar_days'):
+        return
+    op.create_table('calendar_days',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('success_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('fail_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('scheduled_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('challenge_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'date')
+    )
+    op.create_index(op.f('ix_calendar_days_date'), 'calendar_days', ['date'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_calendar_days_date'), table_name='calendar_days')
+    op.drop_table('calendar_days')
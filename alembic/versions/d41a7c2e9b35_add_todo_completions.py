@@ -0,0 +1,53 @@
+"""Add todo_completions and drop todos.completed
+
+Revision ID: d41a7c2e9b35
+Revises: 3c7d95e1f0a2
+Create Date: 2026-10-17 21:12:05.418263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41a7c2e9b35'
+down_revision: Union[str, None] = '3c7d95e1f0a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # If the app's old create_all got here first, the table exists and may
+    # hold completions logged since; the copy below skips those rows.
+    if not sa.inspect(op.get_bind()).has_table('todo_completions'):
+        op.create_table('todo_completions',
+        sa.Column('todo_id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.ForeignKeyConstraint(['todo_id'], ['todos.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('todo_id', 'date')
+        )
+    # A set flag meant completed on the user's current local day, the day
+    # they were last rolled over to.
+    op.execute(sa.text(
+        'INSERT INTO todo_completions (todo_id, date) '
+        'SELECT todos.id, COALESCE(users.rolled_over_on, CURRENT_DATE) '
+        'FROM todos JOIN users ON users.id = todos.creator_id '
+        'WHERE todos.completed AND NOT EXISTS ('
+        'SELECT 1 FROM todo_completions WHERE todo_completions.todo_id = todos.id '
+        'AND todo_completions.date = COALESCE(users.rolled_over_on, CURRENT_DATE))'
+    ))
+    with op.batch_alter_table('todos') as batch_op:
+        batch_op.drop_column('completed')
+
+
+def downgrade() -> None:
+    op.add_column('todos', sa.Column('completed', sa.Boolean(), nullable=True))
+    op.execute(sa.text(
+        'UPDATE todos SET completed = EXISTS ('
+        'SELECT 1 FROM todo_completions JOIN users ON users.id = todos.creator_id '
+        'WHERE todo_completions.todo_id = todos.id '
+        'AND todo_completions.date = COALESCE(users.rolled_over_on, CURRENT_DATE))'
+    ))
+    op.drop_table('todo_completions')
@@ -0,0 +1,513 @@
+"""Latency benchmark for every endpoint in main.py.
+
+Seeds a throwaway database (SQLite by default), then drives each endpoint
+concurrently through the ASGI app in-process and reports p50/p95/p99 latency,
+throughput and SQL statements per request. Results can be saved as a baseline
+and later runs compared against it:
+
+    python bench.py --save bench_baseline.json
+    python bench.py --compare bench_baseline.json
+
+--verify-serialization instead checks that the list endpoints, which
+serialize rows with orjson, return byte-for-byte what validating the ORM
+objects through the pydantic response models would.
+
+--verify-concurrency sends bursts of identical writes for one user at once
+and checks that none fails and that the calendar still matches a rebuild.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Callable, List, NamedTuple, Optional
+from urllib.parse import urlencode
+
+# Seeded titles include non-ASCII text and characters JSON has to escape.
+TITLES = ("bench", "아침 운동", 'quote " backslash \\ tab \t')
+
+_statements = contextvars.ContextVar("bench_statements", default=None)
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    # Builds (path, json body) for the i-th request from the seeded fixture.
+    build: Callable
+    # Fraction of --requests to send; bcrypt-bound endpoints are much slower.
+    share: float = 1.0
+
+
+class Result(NamedTuple):
+    name: str
+    requests: int
+    errors: int
+    p50: float
+    p95: float
+    p99: float
+    throughput: float
+    statements: float
+
+
+class Fixture:
+    def __init__(self):
+        self.users = []  # (id, username, access token, refresh token)
+        self.todos = {}  # user id -> todo ids
+        self.groups = []
+        self.deletable_groups = []
+        self.joined = {}  # user id -> seeded group ids
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def seed(args, fixture: Fixture):
+    from sqlalchemy import insert, select
+
+    import auth
+    import calendar_status
+    import models
+    from database import SessionLocal, engine
+
+    # The app leaves the schema to migrations; a fresh database gets it here.
+    models.Base.metadata.create_all(bind=engine)
+    rng = random.Random(args.seed)
+    today = date.today()
+    hashed_password = auth.get_password_hash("bench")
+    db = SessionLocal()
+    try:
+        db.execute(insert(models.User), [
+            {"username": f"bench{i}", "hashed_password": hashed_password} for i in range(args.users)
+        ])
+        users = db.execute(select(models.User.id, models.User.username).order_by(models.User.id)).all()
+        for user in users:
+            fixture.users.append((
+                user.id,
+                user.username,
+                auth.create_access_token(data={"sub": user.username}, expires_delta=timedelta(hours=2)),
+                auth.create_refresh_token(data={"sub": user.username}),
+            ))
+
+        todos = []
+        for user in users:
+            for _ in range(args.todos_per_user):
+                start = today + timedelta(days=rng.randint(-60, 30))
+                todos.append({
+                    "title": rng.choice(TITLES),
+                    "start_date": start,
+                    "end_date": start + timedelta(days=rng.randint(0, 14)),
+                    "creator_id": user.id,
+                })
+        if todos:
+            db.execute(insert(models.Todo), todos)
+        completions = []
+        for todo in db.execute(select(models.Todo.id, models.Todo.creator_id, models.Todo.start_date,
+                                      models.Todo.end_date)):
+            fixture.todos.setdefault(todo.creator_id, []).append(todo.id)
+            day = todo.start_date
+            while day <= min(todo.end_date, today):
+                if rng.random() < 0.5:
+                    completions.append({"todo_id": todo.id, "date": day})
+                day += timedelta(days=1)
+        if completions:
+            db.execute(insert(models.TodoCompletion), completions)
+
+        user_ids = [user.id for user in users]
+        db.execute(insert(models.Group), [
+            {"name": f"bench-group-{i}", "creator_id": rng.choice(user_ids)} for i in range(args.groups)
+        ] + [
+            {"name": f"bench-delete-{i}", "creator_id": user_ids[0]} for i in range(args.requests)
+        ])
+        for group_id, name in db.execute(select(models.Group.id, models.Group.name)):
+            (fixture.deletable_groups if name.startswith("bench-delete-") else fixture.groups).append(group_id)
+        memberships = [
+            {"user_id": user_id, "group_id": group_id}
+            for group_id in fixture.groups
+            for user_id in rng.sample(user_ids, min(args.members_per_group, len(user_ids)))
+        ]
+        if memberships:
+            db.execute(insert(models.group_membership), memberships)
+        for membership in memberships:
+            fixture.joined.setdefault(membership["user_id"], []).append(membership["group_id"])
+        db.commit()
+        calendar_status.backfill(db, today)
+    finally:
+        db.close()
+
+
+def scenarios(fixture: Fixture, rng: random.Random) -> List[Scenario]:
+    today = date.today()
+
+    def todo_of(user_id):
+        return rng.choice(fixture.todos.get(user_id) or [0])
+
+    def new_todo(offset=0):
+        return {
+            "title": "bench",
+            "start_date": str(today + timedelta(days=offset)),
+            "end_date": str(today + timedelta(days=offset + 3)),
+        }
+
+    month = f"from={today.replace(day=1)}&to={today.replace(day=1) + timedelta(days=30)}"
+    return [
+        Scenario("POST /user", "POST", lambda u, i: ("/user", {"username": f"new{i}-{rng.random()}", "password": "pw"}), share=0.1),
+        Scenario("POST /token", "POST", lambda u, i: ("/token", {"username": u[1], "password": "bench"}), share=0.1),
+        Scenario("POST /token/refresh", "POST", lambda u, i: ("/token/refresh", {"refresh_token": u[3]})),
+        Scenario("POST /todo", "POST", lambda u, i: ("/todo", new_todo())),
+        Scenario("POST /todo/batch", "POST", lambda u, i: ("/todo/batch", [new_todo(offset) for offset in range(7)])),
+        Scenario("GET /todo", "GET", lambda u, i: ("/todo", None)),
+        Scenario("GET /todo?limit=200", "GET", lambda u, i: ("/todo?limit=200", None)),
+        Scenario("GET /todo/export", "GET", lambda u, i: ("/todo/export", None)),
+        Scenario("GET /todo/export (days csv)", "GET", lambda u, i: ("/todo/export?kind=days&format=csv", None)),
+        Scenario("PUT /todo/{id}/complete", "PUT",
+                 lambda u, i: (f"/todo/{todo_of(u[0])}/complete", {"completed": bool(i % 2)})),
+        Scenario("PUT /todo/complete/batch", "PUT", lambda u, i: ("/todo/complete/batch", [
+            {"id": todo_of(u[0]), "completed": bool(i % 2)} for _ in range(7)
+        ])),
+        Scenario("POST /group", "POST", lambda u, i: ("/group", {"name": f"new-group-{i}-{rng.random()}"})),
+        # Ahead of the join and leave scenarios, which change who is a member.
+        Scenario("GET /group/{id}/progress", "GET",
+                 lambda u, i: (f"/group/{rng.choice(fixture.joined.get(u[0]) or fixture.groups)}/progress", None)),
+        Scenario("POST /group/{id}/join", "POST", lambda u, i: (f"/group/{rng.choice(fixture.groups)}/join", None)),
+        Scenario("POST /group/{id}/leave", "POST", lambda u, i: (f"/group/{rng.choice(fixture.groups)}/leave", None)),
+        Scenario("GET /group/joined", "GET", lambda u, i: ("/group/joined", None)),
+        Scenario("GET /group/not-joined", "GET", lambda u, i: ("/group/not-joined", None)),
+        Scenario("GET /group/{id}/members", "GET",
+                 lambda u, i: (f"/group/{rng.choice(fixture.groups)}/members", None)),
+        Scenario("DELETE /group/{id}", "DELETE", lambda u, i: (f"/group/{fixture.deletable_groups[i]}", None)),
+        Scenario("GET /sync", "GET", lambda u, i: ("/sync", None)),
+        # Seeded rows are at version 0, so this returns only what earlier
+        # scenarios changed.
+        Scenario("GET /sync?since=0", "GET", lambda u, i: ("/sync?since=0", None)),
+        Scenario("GET /calendar-status", "GET", lambda u, i: ("/calendar-status", None)),
+        Scenario("GET /calendar-status (month)", "GET", lambda u, i: (f"/calendar-status?{month}", None)),
+        # Both names are UTC, the seeded users' default zone, so their local day
+        # stays put for the scenarios after this one.
+        Scenario("PUT /user/timezone", "PUT",
+                 lambda u, i: ("/user/timezone", {"timezone": "Etc/UTC" if i % 2 else "UTC"})),
+        Scenario("GET /metrics", "GET", lambda u, i: ("/metrics", None)),
+    ]
+
+
+async def run_scenario(client, scenario: Scenario, fixture: Fixture, requests: int, concurrency: int) -> Result:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statements = [], []
+    errors = 0
+    owner = fixture.users[0]
+
+    async def one(i):
+        nonlocal errors
+        # Deleting needs the creator; everything else spreads across users.
+        user = owner if scenario.method == "DELETE" else random.choice(fixture.users)
+        path, body = scenario.build(user, i)
+        headers = {"Authorization": f"Bearer {user[2]}"}
+        async with semaphore:
+            counter = [0]
+            _statements.set(counter)
+            started = time.perf_counter()
+            response = await client.request(scenario.method, path, json=body, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statements.append(counter[0])
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    return Result(
+        name=scenario.name,
+        requests=requests,
+        errors=errors,
+        p50=percentile(latencies, 0.50) * 1000,
+        p95=percentile(latencies, 0.95) * 1000,
+        p99=percentile(latencies, 0.99) * 1000,
+        throughput=requests / elapsed if elapsed else 0.0,
+        statements=sum(statements) / len(statements) if statements else 0.0,
+    )
+
+
+async def verify_serialization(client, fixture: Fixture) -> List[str]:
+    import models
+    import queries
+    import schemas
+    from database import SessionLocal
+    from pagination import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor
+    from response_cache import render
+
+    db = SessionLocal()
+
+    def reference_page(page_model, query, key, cursor, limit, attribute=None):
+        # pagination.paginate over ORM entities, rendered through pydantic.
+        if cursor is not None:
+            query = query.where(key > decode_cursor(cursor))
+        items = db.execute(query.order_by(key).limit(limit + 1)).scalars().all()
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(getattr(items[-1], attribute or key.key))
+        return render(page_model, {"items": items, "next_cursor": next_cursor})
+
+    mismatches = []
+
+    async def compare(path, headers, expected):
+        response = await client.get(path, headers=headers)
+        if response.content != expected:
+            mismatches.append(f"{path}: {len(response.content)} bytes, expected {len(expected)}")
+        return response
+
+    async def compare_pages(path, headers, page_model, query, key, attribute=None):
+        for limit in (DEFAULT_PAGE_SIZE, 7):
+            cursor = None
+            while True:
+                params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+                response = await compare(
+                    f"{path}?{urlencode(params)}", headers,
+                    reference_page(page_model, query, key, cursor, limit, attribute),
+                )
+                cursor = response.json().get("next_cursor")
+                if cursor is None:
+                    break
+
+    try:
+        for user_id, _, access_token, _ in fixture.users:
+            headers = {"Authorization": f"Bearer {access_token}"}
+            await compare_pages(
+                "/todo", headers, schemas.TodoPage, queries.user_todos(user_id, date.today()), models.Todo.id
+            )
+            await compare(
+                "/group/joined", headers,
+                render(List[schemas.Group], db.execute(queries.joined_groups(user_id)).scalars().all()),
+            )
+            await compare_pages(
+                "/group/not-joined", headers, schemas.GroupPage, queries.not_joined_groups(user_id), models.Group.id
+            )
+        headers = {"Authorization": f"Bearer {fixture.users[0][2]}"}
+        for group_id in fixture.groups:
+            await compare_pages(
+                f"/group/{group_id}/members", headers, schemas.UserPage,
+                queries.group_members(group_id), queries.membership.c.user_id, "id",
+            )
+    finally:
+        db.close()
+    return mismatches
+
+
+async def verify_concurrency(client, fixture: Fixture, concurrency: int) -> List[str]:
+    import calendar_status
+    import queries
+    from database import SessionLocal
+
+    user_id, _, access_token, _ = fixture.users[0]
+    headers = {"Authorization": f"Bearer {access_token}"}
+    today = date.today()
+    problems = []
+
+    async def burst(method, path, body):
+        responses = await asyncio.gather(*(
+            client.request(method, path, json=body, headers=headers) for _ in range(max(concurrency, 2))
+        ))
+        for response in responses:
+            if response.status_code >= 400:
+                problems.append(f"{method} {path}: {response.status_code} {response.text[:200]}")
+
+    # Far enough ahead that no seeded todo reaches it, so every request in a
+    # burst finds the same calendar rows missing.
+    fresh = today + timedelta(days=400)
+    todo = {"title": "bench", "start_date": str(fresh), "end_date": str(fresh + timedelta(days=6))}
+    await burst("POST", "/todo", todo)
+    await burst("POST", "/todo/batch", [
+        {**todo, "start_date": str(fresh + timedelta(days=5)), "end_date": str(fresh + timedelta(days=12))}, todo,
+    ])
+
+    # Repeated taps on one checkbox, each state sent several times at once.
+    todo = {"title": "bench", "start_date": str(today), "end_date": str(today)}
+    todo_id = (await client.post("/todo", json=todo, headers=headers)).json()["id"]
+    for completed in (True, False, True):
+        await burst("PUT", f"/todo/{todo_id}/complete", {"completed": completed})
+    await burst("PUT", "/todo/complete/batch", [{"id": todo_id, "completed": False}])
+    # Seeded with no members.
+    if fixture.deletable_groups:
+        await burst("POST", f"/group/{fixture.deletable_groups[0]}/join", None)
+
+    # Reading the calendar first writes out anything the completion buffer holds.
+    await client.get("/calendar-status", headers=headers)
+    db = SessionLocal()
+    try:
+        todos = db.execute(queries.todos_in_window([user_id])).all()
+        completions_by_todo = defaultdict(set)
+        for todo_id, day in db.execute(queries.completions_in_window([user_id])):
+            completions_by_todo[todo_id].add(day)
+        expected = dict(calendar_status.sweep_counts(todos, today, completions_by_todo=completions_by_todo))
+        for row in db.execute(queries.calendar_days(user_id)):
+            counts = {column: getattr(row, column) for column in calendar_status.COUNT_COLUMNS}
+            if counts != expected.pop(row.date, dict.fromkeys(calendar_status.COUNT_COLUMNS, 0)):
+                problems.append(f"calendar {row.date}: {counts}")
+        problems.extend(f"calendar {day}: missing" for day in expected)
+    finally:
+        db.close()
+    return problems
+
+
+async def run(args) -> List[Result]:
+    import httpx
+    from sqlalchemy import event
+
+    import database
+    import main
+    from hashing import password_hasher
+
+    def count_statement(*_):
+        counter = _statements.get()
+        if counter is not None:
+            counter[0] += 1
+
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    fixture = Fixture()
+    seed(args, fixture)
+    rng = random.Random(args.seed)
+    selected = [
+        scenario for scenario in scenarios(fixture, rng)
+        if not args.only or any(name in scenario.name for name in args.only)
+    ]
+
+    results = []
+    # A server error comes back as a 500 and is counted, rather than being
+    # re-raised here and ending the run.
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # Warm the token cache and connection pool so the first scenario
+            # is not charged for every user's first lookup.
+            for user in fixture.users:
+                await client.get("/todo?limit=1", headers={"Authorization": f"Bearer {user[2]}"})
+            if args.verify_serialization:
+                args.mismatches = await verify_serialization(client, fixture)
+                return results
+            if args.verify_concurrency:
+                args.mismatches = await verify_concurrency(client, fixture, args.concurrency)
+                return results
+            for scenario in selected:
+                requests = max(1, int(args.requests * scenario.share))
+                results.append(await run_scenario(client, scenario, fixture, requests, args.concurrency))
+    finally:
+        password_hasher.shutdown()
+        await database.async_engine.dispose()
+    return results
+
+
+def print_results(results: List[Result], baseline: Optional[dict] = None):
+    header = f"{'endpoint':<32} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'sql/req':>8}"
+    if baseline is not None:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    for result in results:
+        line = (
+            f"{result.name:<32} {result.requests:>5} {result.errors:>4} {result.p50:>9.2f} {result.p95:>9.2f} "
+            f"{result.p99:>9.2f} {result.throughput:>9.1f} {result.statements:>8.1f}"
+        )
+        if baseline is not None and result.name in baseline:
+            base = baseline[result.name]["p95"]
+            line += f" {(result.p95 / base - 1) * 100 if base else 0.0:>+11.1f}%"
+        print(line)
+
+
+def regressions(results: List[Result], baseline: dict, threshold: float) -> List[str]:
+    found = []
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None:
+            continue
+        if result.p95 > base["p95"] * (1 + threshold):
+            found.append(f"{result.name}: p95 {base['p95']:.2f} -> {result.p95:.2f} ms")
+        if round(result.statements, 1) > round(base["statements"], 1):
+            found.append(f"{result.name}: sql/req {base['statements']:.1f} -> {result.statements:.1f}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every endpoint through the ASGI app")
+    parser.add_argument("--database-url", help="database to seed (default: a temporary SQLite file)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--todos-per-user", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--members-per-group", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="run endpoints whose name contains any of these")
+    parser.add_argument("--save", help="write results to this JSON baseline")
+    parser.add_argument("--compare", help="compare against this JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p95 slowdown vs baseline")
+    parser.add_argument("--verify-serialization", action="store_true",
+                        help="compare the list endpoints' JSON with the pydantic rendering instead of benchmarking")
+    parser.add_argument("--verify-concurrency", action="store_true",
+                        help="check that simultaneous writes for one user all succeed and keep the calendar right")
+    args = parser.parse_args()
+
+    workdir = None
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        workdir = tempfile.TemporaryDirectory()
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir.name, 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    # A handful of seeded users send every request, which per-user rate
+    # limits would mostly turn away; set RATE_LIMIT_ENABLED=true to include them.
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+
+    if args.verify_serialization:
+        if workdir is not None:
+            workdir.cleanup()
+        for mismatch in args.mismatches:
+            print(f"MISMATCH {mismatch}")
+        print(f"serialization: {len(args.mismatches)} mismatches")
+        sys.exit(1 if args.mismatches else 0)
+    if args.verify_concurrency:
+        if workdir is not None:
+            workdir.cleanup()
+        for problem in args.mismatches:
+            print(f"PROBLEM {problem}")
+        print(f"concurrency: {len(args.mismatches)} problems")
+        sys.exit(1 if args.mismatches else 0)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "params": {key: value for key, value in vars(args).items() if key not in ("save", "compare")},
+                "results": {result.name: result._asdict() for result in results},
+            }, f, indent=2)
+
+    if workdir is not None:
+        workdir.cleanup()
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
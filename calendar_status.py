@@ -0,0 +1,265 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from itertools import groupby
+from typing import Optional
+
+from sqlalchemy import bindparam, case, delete, or_, select, update
+from sqlalchemy.orm import Session
+
+import models
+import queries
+import timezones
+from database import insert_missing
+
+SUCCESS = "성공"
+FAIL = "실패"
+SCHEDULED = "예정"
+CHALLENGE = "도전"
+
+days = queries.days
+completions = queries.completions
+
+COUNT_COLUMNS = ("success_count", "fail_count", "scheduled_count", "challenge_count")
+# Rows per backfill INSERT, keeping its parameters under SQLite's old limit
+# of 999.
+BACKFILL_INSERT_ROWS = 150
+
+
+def day_status(row) -> str:
+    if row.fail_count:
+        return FAIL
+    if row.challenge_count:
+        return CHALLENGE
+    if row.scheduled_count:
+        return SCHEDULED
+    return SUCCESS
+
+
+def _ensure_days(db: Session, user_id: int, dates):
+    # `dates` must be sorted; existing rows are found with one range read so
+    # the insert usually only carries the days that are really new.
+    existing = set(db.execute(
+        select(days.c.date).where(days.c.user_id == user_id, days.c.date.between(dates[0], dates[-1]))
+    ).scalars())
+    insert_missing(db, days, [{"user_id": user_id, "date": day} for day in dates if day not in existing])
+
+
+def add_todo(db: Session, todo: models.Todo, today: Optional[date] = None):
+    # A new todo is not completed, so it counts as failed on past days, as the
+    # open challenge today and as scheduled on future days.
+    today = today or date.today()
+    if todo.start_date > todo.end_date:
+        return
+    _ensure_days(db, todo.creator_id, [
+        todo.start_date + timedelta(days=offset) for offset in range((todo.end_date - todo.start_date).days + 1)
+    ])
+    db.execute(
+        update(days)
+        .where(days.c.user_id == todo.creator_id, days.c.date.between(todo.start_date, todo.end_date))
+        .values(
+            fail_count=days.c.fail_count + case((days.c.date < today, 1), else_=0),
+            challenge_count=days.c.challenge_count + case((days.c.date == today, 1), else_=0),
+            scheduled_count=days.c.scheduled_count + case((days.c.date > today, 1), else_=0),
+        )
+    )
+
+
+def set_completed(db: Session, todo: models.Todo, completed: bool, today: Optional[date] = None):
+    return set_many_completed(db, todo.creator_id, {todo.id: todo}, {todo.id: completed}, today)
+
+
+def set_many_completed(db: Session, user_id: int, todos: dict, wanted: dict, today: Optional[date] = None):
+    # Records or removes today's completion of each of the user's `todos` (by
+    # id) as `wanted` says, sets their `completed` to match and returns the ids
+    # that actually changed. Only today's cell follows completions; past days
+    # were frozen by finalize_day and future days only start counting once
+    # they arrive.
+    today = today or date.today()
+    if not todos:
+        return []
+    done = set(db.execute(queries.completed_todos(list(todos), today)).scalars())
+    added = [todo_id for todo_id in todos if wanted[todo_id] and todo_id not in done]
+    removed = [todo_id for todo_id in todos if not wanted[todo_id] and todo_id in done]
+    # A concurrent request for the same todos may have got there first, so
+    # today's cell moves by the rows actually written, not by the read above.
+    active = {todo_id for todo_id, todo in todos.items() if todo.start_date <= today <= todo.end_date}
+    _write_completions(
+        db, [todo_id for todo_id in added if todo_id not in active],
+        [todo_id for todo_id in removed if todo_id not in active], today,
+    )
+    delta = _write_completions(
+        db, [todo_id for todo_id in added if todo_id in active],
+        [todo_id for todo_id in removed if todo_id in active], today,
+    )
+    shift_today(db, user_id, delta, today)
+    for todo_id, todo in todos.items():
+        todo.completed = wanted[todo_id]
+    return added + removed
+
+
+def _write_completions(db: Session, added, removed, today: date) -> int:
+    # Returns rows inserted minus rows deleted.
+    inserted = insert_missing(db, completions, [{"todo_id": todo_id, "date": today} for todo_id in added])
+    deleted = 0
+    if removed:
+        deleted = db.execute(
+            delete(completions).where(completions.c.todo_id.in_(removed), completions.c.date == today)
+        ).rowcount
+    return inserted - deleted
+
+
+def shift_today(db: Session, user_id: int, delta: int, today: Optional[date] = None):
+    # Moves `delta` of today's todos from challenge to success (negative to undo).
+    today = today or date.today()
+    if not delta:
+        return
+    db.execute(
+        update(days)
+        .where(days.c.user_id == user_id, days.c.date == today)
+        .values(
+            success_count=days.c.success_count + delta,
+            challenge_count=days.c.challenge_count - delta,
+        )
+    )
+
+
+def add_todos(db: Session, user_id: int, todos, today: Optional[date] = None):
+    # Bulk form of add_todo: one sweep over the new todos yields each day's
+    # increments, which are applied with a single executemany UPDATE.
+    today = today or date.today()
+    counts = list(sweep_counts(todos, today))
+    if not counts:
+        return
+    _ensure_days(db, user_id, [day for day, _ in counts])
+    db.execute(
+        update(days)
+        .where(days.c.user_id == bindparam("b_user_id"), days.c.date == bindparam("b_date"))
+        .values({column: days.c[column] + bindparam("b_" + column) for column in COUNT_COLUMNS}),
+        [
+            {"b_user_id": user_id, "b_date": day, **{"b_" + column: value for column, value in day_counts.items()}}
+            for day, day_counts in counts
+        ],
+    )
+
+
+def finalize_day(db: Session, today: date, user_ids=None) -> int:
+    # Runs once the user's local date has moved on: whatever was still open on
+    # earlier days failed, and everything scheduled for the new day becomes
+    # today's challenge. The caller commits.
+    scope = [] if user_ids is None else [days.c.user_id.in_(user_ids)]
+    failed = db.execute(
+        update(days)
+        .where(*scope, days.c.date < today, or_(days.c.challenge_count > 0, days.c.scheduled_count > 0))
+        .values(
+            fail_count=days.c.fail_count + days.c.challenge_count + days.c.scheduled_count,
+            challenge_count=0,
+            scheduled_count=0,
+        )
+    )
+    started = db.execute(
+        update(days)
+        .where(*scope, days.c.date == today, days.c.scheduled_count > 0)
+        .values(
+            challenge_count=days.c.challenge_count + days.c.scheduled_count,
+            scheduled_count=0,
+        )
+    )
+    return failed.rowcount + started.rowcount
+
+
+def read(db: Session, user_id: int, start: Optional[date] = None, end: Optional[date] = None):
+    rows = db.execute(queries.calendar_days(user_id, start, end)).all()
+    return [{"date": row.date, "status": day_status(row)} for row in rows]
+
+
+def _pieces(todo, today: date, done=()):
+    # Splits a todo's range into the part before today, today itself and the
+    # part after today, each counted in a single column with a weight. Past
+    # days the todo was completed on (`done`) move from failed to succeeded.
+    yesterday, tomorrow = today - timedelta(days=1), today + timedelta(days=1)
+    past_end = min(todo.end_date, yesterday)
+    yield todo.start_date, past_end, "fail_count", 1
+    for day in done:
+        if todo.start_date <= day <= past_end:
+            yield day, day, "fail_count", -1
+            yield day, day, "success_count", 1
+    if todo.start_date <= today <= todo.end_date:
+        yield today, today, "success_count" if today in done else "challenge_count", 1
+    yield max(todo.start_date, tomorrow), todo.end_date, "scheduled_count", 1
+
+
+def sweep_counts(todos, today: date, start: Optional[date] = None, end: Optional[date] = None,
+                 completions_by_todo: Optional[dict] = None):
+    # Sweep line over interval endpoints: every piece adds its weight at its
+    # first day and takes it back the day after its last, so after sorting the
+    # O(todos + completions) endpoints a single pass yields each covered day's
+    # counts without expanding ranges. `completions_by_todo` maps todo ids to
+    # the days they were completed on.
+    events = defaultdict(lambda: dict.fromkeys(COUNT_COLUMNS, 0))
+    for todo in todos:
+        done = completions_by_todo.get(todo.id, ()) if completions_by_todo else ()
+        for low, high, column, weight in _pieces(todo, today, done):
+            if start is not None:
+                low = max(low, start)
+            if end is not None:
+                high = min(high, end)
+            if low > high:
+                continue
+            events[low][column] += weight
+            events[high + timedelta(days=1)][column] -= weight
+
+    running = dict.fromkeys(COUNT_COLUMNS, 0)
+    points = sorted(events)
+    for point, next_point in zip(points, points[1:]):
+        for column, delta in events[point].items():
+            running[column] += delta
+        if not any(running.values()):
+            continue
+        day = point
+        while day < next_point:
+            yield day, dict(running)
+            day += timedelta(days=1)
+
+
+def backfill(db: Session, today: Optional[date] = None, start: Optional[date] = None,
+             end: Optional[date] = None, batch_size: int = 100) -> int:
+    # Rebuilds the rows of every user with todos in the window, `batch_size`
+    # users per transaction. Users are paged by id rather than streamed from
+    # one long-lived cursor, which SQLite would hold a read lock for and so
+    # refuse the commits in between. Without `today`, each user's own local
+    # date is used.
+    #
+    # Days before a user's last rollover also counted the todos it deleted,
+    # which the current todos can't reproduce, so those days only gain the
+    # rows they are missing; from the rollover on they are rebuilt.
+    window = []
+    if start is not None:
+        window.append(days.c.date >= start)
+    if end is not None:
+        window.append(days.c.date <= end)
+
+    rows = 0
+    last_id = 0
+    while True:
+        user_ids = db.execute(queries.todo_creators_in_window(last_id, batch_size, start, end)).scalars().all()
+        if not user_ids:
+            break
+        todos = db.execute(queries.todos_in_window(user_ids, start, end)).all()
+        completions_by_todo = defaultdict(set)
+        for todo_id, day in db.execute(queries.completions_in_window(user_ids, start, end)):
+            completions_by_todo[todo_id].add(day)
+        for user_id, user_todos in groupby(todos, key=lambda todo: todo.creator_id):
+            user_todos = list(user_todos)
+            user_today = today or timezones.today_in(user_todos[0].timezone)
+            rolled_over_on = user_todos[0].rolled_over_on
+            counts = [
+                {"user_id": user_id, "date": day, **day_counts}
+                for day, day_counts in sweep_counts(user_todos, user_today, start, end, completions_by_todo)
+            ]
+            rebuilt = [] if rolled_over_on is None else [days.c.date >= rolled_over_on]
+            db.execute(delete(days).where(days.c.user_id == user_id, *window, *rebuilt))
+            for offset in range(0, len(counts), BACKFILL_INSERT_ROWS):
+                rows += insert_missing(db, days, counts[offset:offset + BACKFILL_INSERT_ROWS])
+        db.commit()
+        last_id = user_ids[-1]
+    return rows
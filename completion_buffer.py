@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import date
+from typing import Dict, NamedTuple, Optional, Set
+
+import calendar_status
+import events
+import metrics
+import queries
+import response_cache
+import sync
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Off by default. When on, completion changes are acknowledged at once and
+# written in batches; repeated taps on one todo between flushes cost a single
+# write of the last state.
+COMPLETION_WRITE_BEHIND = os.getenv("COMPLETION_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+COMPLETION_FLUSH_INTERVAL_MS = int(os.getenv("COMPLETION_FLUSH_INTERVAL_MS", "250"))
+# The request that fills the buffer to this size flushes it before it returns.
+COMPLETION_BUFFER_MAX_PENDING = int(os.getenv("COMPLETION_BUFFER_MAX_PENDING", "1000"))
+
+
+class Pending(NamedTuple):
+    completed: bool
+    today: date
+
+
+async def write(batch: Dict[int, Dict[int, Pending]]):
+    # Applies the last state of every buffered todo in one transaction, then
+    # does what the direct path does after committing.
+    todo_ids = [todo_id for entries in batch.values() for todo_id in entries]
+    changes = []
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(queries.todos_by_id(todo_ids))
+        todos = {todo.id: todo for todo in result.scalars()}
+        for user_id, entries in batch.items():
+            by_day = defaultdict(dict)
+            for todo_id, pending in entries.items():
+                # Rollover may have deleted the todo since.
+                if todo_id in todos:
+                    by_day[pending.today][todo_id] = pending.completed
+            for today, wanted in by_day.items():
+                owned = {todo_id: todos[todo_id] for todo_id in wanted}
+                changed = await db.run_sync(calendar_status.set_many_completed, user_id, owned, wanted, today)
+                if changed:
+                    changes.append((user_id, today, [owned[todo_id] for todo_id in changed]))
+        if changes:
+            await db.run_sync(sync.stamp, *(todo for _, _, changed in changes for todo in changed))
+        await db.commit()
+        await response_cache.invalidate((response_cache.TODOS, response_cache.CALENDAR), list(batch))
+        for user_id, today, changed in changes:
+            await events.publish_progress(db, user_id, today, changed)
+
+
+class CompletionBuffer:
+    def __init__(self, interval_ms: int = COMPLETION_FLUSH_INTERVAL_MS,
+                 max_pending: int = COMPLETION_BUFFER_MAX_PENDING, writer=write):
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self.writer = writer
+        self._pending: Dict[int, Dict[int, Pending]] = {}
+        self._size = 0
+        self._writing: Set[int] = set()
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    async def put(self, user_id: int, todo_id: int, completed: bool, today: date):
+        entries = self._pending.setdefault(user_id, {})
+        if todo_id in entries:
+            metrics.COMPLETIONS_COALESCED.inc()
+        else:
+            self._size += 1
+        entries[todo_id] = Pending(completed, today)
+        metrics.COMPLETIONS_PENDING.set(self._size)
+        if self._size >= self.max_pending:
+            await self.flush()
+
+    async def flush(self, user_id: Optional[int] = None):
+        # Flushes run one at a time, so a todo's states reach the database in
+        # the order they were buffered.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if user_id is None:
+                batch, self._pending, self._size = self._pending, {}, 0
+            else:
+                batch = {user_id: self._pending.pop(user_id)} if user_id in self._pending else {}
+                self._size -= len(batch.get(user_id, ()))
+            metrics.COMPLETIONS_PENDING.set(self._size)
+            if not batch:
+                return
+            self._writing = set(batch)
+            try:
+                await self.writer(batch)
+            except BaseException:
+                # Cancellation included: the transaction is rolled back, so
+                # the batch must stay pending. If a commit did land before the
+                # cancel, writing it again changes nothing.
+                self._requeue(batch)
+                raise
+            finally:
+                self._writing = set()
+
+    def _requeue(self, batch: Dict[int, Dict[int, Pending]]):
+        # Anything buffered while the failed write ran is newer and wins.
+        for user_id, entries in batch.items():
+            current = self._pending.setdefault(user_id, {})
+            for todo_id, pending in entries.items():
+                if todo_id not in current:
+                    current[todo_id] = pending
+                    self._size += 1
+        metrics.COMPLETIONS_PENDING.set(self._size)
+
+    async def flush_user(self, user_id: int):
+        # Read-your-writes: before serving a user's own data, write out what
+        # they have buffered, or wait for the flush that is writing it. Users
+        # with nothing buffered pay nothing.
+        if user_id in self._pending or user_id in self._writing:
+            await self.flush(user_id)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("completion flush failed, will retry")
+
+    def start(self):
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # The loop is told to stop rather than cancelled, so a flush in
+        # progress completes; it then flushes once more on its way out, and
+        # the flush here picks up anything buffered after that.
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+buffer = CompletionBuffer()
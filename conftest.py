@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+import pytest
+
+# database.py reads these on import, so they are set before any test module
+# imports the app. Every test gets an empty schema in a throwaway SQLite file.
+_workdir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir.name, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+
+
+@pytest.fixture(autouse=True)
+def schema():
+    import models
+    from database import engine
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import NamedTuple, Optional
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import auth
+import models
+import timezones
+from database import get_db
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+class CurrentUser(NamedTuple):
+    id: int
+    username: str
+    timezone: str
+
+    def today(self) -> date:
+        return timezones.today_in(self.timezone)
+
+
+class TokenCache:
+    # LRU map from a verified access token to the user it resolved to. Entries
+    # expire after `ttl` seconds or at the token's own `exp`, whichever is first.
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[CurrentUser]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: CurrentUser, exp: float):
+        expires_at = min(time.time() + self.ttl, exp)
+        with self._lock:
+            self._entries[token] = (user, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in [token for token, (user, _) in self._entries.items() if user.id == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    token_cache.invalidate_user(target.id)
+
+
+async def current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> CurrentUser:
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+
+    user_info = auth.decode_access_token(token)
+    if user_info is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    result = await db.execute(
+        select(models.User.id, models.User.username, models.User.timezone).where(models.User.username == user_info["sub"])
+    )
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    user = CurrentUser(id=row.id, username=row.username, timezone=row.timezone)
+    token_cache.put(token, user, user_info["exp"])
+    return user
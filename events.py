@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Dict, Optional, Set
+
+import orjson
+
+import metrics
+import queries
+import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Unset keeps events inside this process; "redis://..." fans them out to every
+# worker and replica through Redis pub/sub, and "fake://..." uses
+# redis_client.FakeRedis's in-memory pub/sub.
+EVENTS_BROKER_URL = os.getenv("EVENTS_BROKER_URL")
+# Frames a connection may have waiting before it is considered too slow and
+# told to resync, so one stalled client never holds memory or slows a publish.
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+PROGRESS = "progress"
+MEMBER_JOINED = "member_joined"
+MEMBER_LEFT = "member_left"
+GROUP_DELETED = "group_deleted"
+
+Deliver = Callable[[str, bytes], None]
+
+
+def group_channel(group_id: int) -> str:
+    return f"group:{group_id}"
+
+
+class LocalBroker:
+    # Delivers in process. Several hubs may share one instance, which is how
+    # tests stand in for several workers.
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Deliver]] = defaultdict(set)
+
+    async def publish(self, channel: str, message: bytes):
+        for deliver in list(self._subscribers.get(channel, ())):
+            deliver(channel, message)
+
+    async def subscribe(self, channel: str, deliver: Deliver):
+        self._subscribers[channel].add(deliver)
+
+    async def unsubscribe(self, channel: str, deliver: Deliver):
+        self._subscribers[channel].discard(deliver)
+        if not self._subscribers[channel]:
+            del self._subscribers[channel]
+
+    async def close(self):
+        pass
+
+
+class RedisBroker:
+    def __init__(self, client):
+        self.client = client
+        self.pubsub = client.pubsub()
+        self._subscribers: Dict[str, Set[Deliver]] = defaultdict(set)
+        self._reader: Optional[asyncio.Task] = None
+
+    async def publish(self, channel: str, message: bytes):
+        await self.client.publish(channel, message)
+
+    async def subscribe(self, channel: str, deliver: Deliver):
+        if not self._subscribers[channel]:
+            await self.pubsub.subscribe(channel)
+        self._subscribers[channel].add(deliver)
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, channel: str, deliver: Deliver):
+        self._subscribers[channel].discard(deliver)
+        if not self._subscribers[channel]:
+            del self._subscribers[channel]
+            await self.pubsub.unsubscribe(channel)
+
+    async def _read(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("event broker read failed")
+                await asyncio.sleep(1.0)
+                continue
+            if message is None:
+                continue
+            channel = message["channel"]
+            channel = channel.decode() if isinstance(channel, bytes) else channel
+            for deliver in list(self._subscribers.get(channel, ())):
+                deliver(channel, message["data"])
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        await self.pubsub.close()
+
+
+def make_broker(url: Optional[str] = EVENTS_BROKER_URL):
+    if not url:
+        return LocalBroker()
+    return RedisBroker(redis_client.connect(url, "EVENTS_BROKER_URL"))
+
+
+def _frame(event_type: str, message: bytes) -> bytes:
+    return b"event: " + event_type.encode() + b"\ndata: " + message + b"\n\n"
+
+
+# Both end a connection: RESYNC tells a client that fell behind to refetch,
+# CLOSE follows the last event a client is allowed to see.
+RESYNC = _frame("resync", b"{}")
+CLOSE = object()
+
+
+class Subscription:
+    def __init__(self, channel: str, user_id: int, maxsize: int):
+        self.channel = channel
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+
+class Hub:
+    # Fans the events of each channel out to this process's subscribers. The
+    # broker carries each event once per process, and each event is framed
+    # once however many connections receive it.
+
+    def __init__(self, broker=None, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.broker = broker if broker is not None else make_broker()
+        self.queue_size = queue_size
+        self._subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+
+    async def publish(self, channel: str, event: dict):
+        await self.broker.publish(channel, orjson.dumps(event))
+
+    async def subscribe(self, channel: str, user_id: int) -> Subscription:
+        subscription = Subscription(channel, user_id, self.queue_size)
+        if not self._subscriptions[channel]:
+            await self.broker.subscribe(channel, self._deliver)
+        self._subscriptions[channel].add(subscription)
+        metrics.EVENT_SUBSCRIBERS.inc()
+        return subscription
+
+    async def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscriptions[subscription.channel]
+        subscribers.discard(subscription)
+        metrics.EVENT_SUBSCRIBERS.dec()
+        if not subscribers:
+            del self._subscriptions[subscription.channel]
+            await self.broker.unsubscribe(subscription.channel, self._deliver)
+
+    def _deliver(self, channel: str, message: bytes):
+        event = orjson.loads(message)
+        frame = _frame(event["type"], message)
+        for subscription in list(self._subscriptions.get(channel, ())):
+            if subscription.closed:
+                continue
+            # Members who leave, and everyone when the group goes, get this
+            # last event and are then disconnected.
+            ends = event["type"] == GROUP_DELETED or (
+                event["type"] == MEMBER_LEFT and event["user_id"] == subscription.user_id
+            )
+            try:
+                subscription.queue.put_nowait(frame)
+                if ends:
+                    subscription.queue.put_nowait(CLOSE)
+                    subscription.closed = True
+            except asyncio.QueueFull:
+                self._overflow(subscription)
+
+    def _overflow(self, subscription: Subscription):
+        # Dropping frames would leave the client silently wrong, so its queue
+        # is replaced by a single resync and it stops receiving.
+        metrics.EVENT_OVERFLOWS.inc()
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(RESYNC)
+        subscription.closed = True
+
+    async def stream(self, channel: str, user_id: int) -> AsyncIterator[bytes]:
+        # Server-sent events for one connection. "ready" follows the
+        # subscription, so state the client fetches after it can only be
+        # followed by newer events.
+        subscription = await self.subscribe(channel, user_id)
+        try:
+            yield _frame("ready", b"{}")
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscription.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if frame is CLOSE:
+                    return
+                yield frame
+                if frame is RESYNC:
+                    return
+        finally:
+            await self.unsubscribe(subscription)
+
+    async def close(self):
+        await self.broker.close()
+
+
+hub = Hub()
+
+
+async def publish_progress(db, user_id: int, today, todos):
+    # Members follow each other's progress through /group/{id}/events instead
+    # of polling, so completions go out to every group the user is in.
+    if not todos:
+        return
+    result = await db.execute(queries.user_group_ids(user_id))
+    event = {
+        "type": PROGRESS,
+        "user_id": user_id,
+        "date": today,
+        "todos": [{"id": todo.id, "completed": todo.completed} for todo in todos],
+    }
+    for group_id in result.scalars():
+        await hub.publish(group_channel(group_id), event)
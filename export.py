@@ -0,0 +1,82 @@
+import csv
+import io
+import os
+from datetime import date
+from typing import AsyncIterator, Optional
+
+import orjson
+
+import calendar_status
+import queries
+from database import AsyncSessionLocal
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+TODO_FIELDS = ("id", "title", "start_date", "end_date", "completed", "status")
+DAY_FIELDS = ("date", "status", "success_count", "fail_count", "scheduled_count", "challenge_count")
+
+
+def todo_status(todo, today: date) -> str:
+    # The todo's status as of today, in the calendar's terms.
+    if todo.completed:
+        return calendar_status.SUCCESS
+    if todo.end_date < today:
+        return calendar_status.FAIL
+    if todo.start_date > today:
+        return calendar_status.SCHEDULED
+    return calendar_status.CHALLENGE
+
+
+def _todo_record(row, today: date) -> dict:
+    return {**row._asdict(), "status": todo_status(row, today)}
+
+
+def _day_record(row) -> dict:
+    return {
+        "date": row.date,
+        "status": calendar_status.day_status(row),
+        **{column: getattr(row, column) for column in calendar_status.COUNT_COLUMNS},
+    }
+
+
+def _ndjson(records) -> bytes:
+    return b"".join(orjson.dumps(record) + b"\n" for record in records)
+
+
+def _csv(records, fields, header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    if header:
+        writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue().encode()
+
+
+async def stream(kind: str, fmt: str, user_id: int, today: date,
+                 start: Optional[date] = None, end: Optional[date] = None) -> AsyncIterator[bytes]:
+    # Streams a user's todos or calendar days from a server-side cursor,
+    # EXPORT_BATCH_SIZE rows per chunk, so memory stays flat however long
+    # the history is. The generator opens its own session because it runs
+    # while the response is being sent, after the request's dependencies.
+    if kind == "days":
+        query, fields, record = queries.calendar_days(user_id, start, end), DAY_FIELDS, _day_record
+    else:
+        query, fields = queries.todo_export(user_id, today, start, end), TODO_FIELDS
+
+        def record(row):
+            return _todo_record(row, today)
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        header = True
+        async for rows in result.partitions():
+            records = [record(row) for row in rows]
+            yield _ndjson(records) if fmt == "ndjson" else _csv(records, fields, header)
+            header = False
+        if header and fmt == "csv":
+            yield _csv([], fields, header)
@@ -0,0 +1,130 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException, status
+
+import auth
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 4)))
+# The pool starts inside a running server, where a fork would copy locks held
+# by its other threads; workers from a fork server or a fresh interpreter
+# don't inherit them.
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _timed(func, *args):
+    started = time.time()
+    result = func(*args)
+    return result, started, time.time() - started
+
+
+def _busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
+class HashStats:
+    def __init__(self):
+        self.count = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+
+    def record(self, wait: float, duration: float):
+        self.count += 1
+        self.wait_seconds_total += wait
+        self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        self.hash_seconds_total += duration
+        self.hash_seconds_max = max(self.hash_seconds_max, duration)
+
+
+class PasswordHasher:
+    # bcrypt is CPU bound and holds the GIL, so it runs in worker processes.
+    # At most `max_pending` calls may be queued or running; beyond that the
+    # caller gets a 503 rather than an ever-growing queue.
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stats = HashStats()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(_START_METHOD)
+                )
+            return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor):
+        # A worker died (OOM kill, crash) and took the pool with it. The next
+        # call starts a new one; calls that were already queued fail too.
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.stats.rejected += 1
+                raise _busy()
+            self.pending += 1
+        submitted = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            pool = self._get_pool()
+            try:
+                result, started, duration = await loop.run_in_executor(pool, _timed, func, *args)
+            except BrokenProcessPool:
+                self._discard(pool)
+                raise _busy()
+        finally:
+            with self._lock:
+                self.pending -= 1
+        with self._lock:
+            self.stats.record(max(started - submitted, 0.0), duration)
+        return result
+
+    async def verify_password(self, plain_password, hashed_password) -> bool:
+        return await self._submit(auth.verify_password, plain_password, hashed_password)
+
+    async def get_password_hash(self, password) -> str:
+        return await self._submit(auth.get_password_hash, password)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = self.stats
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "count": stats.count,
+                "rejected": stats.rejected,
+                "wait_seconds_total": stats.wait_seconds_total,
+                "wait_seconds_max": stats.wait_seconds_max,
+                "hash_seconds_total": stats.hash_seconds_total,
+                "hash_seconds_max": stats.hash_seconds_max,
+            }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
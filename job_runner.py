@@ -0,0 +1,156 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+import models
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# "database" claims runs through the job_runs table so exactly one worker or
+# replica runs each firing; "local" keeps claims in memory for tests and
+# single-process development.
+JOB_LOCK_BACKEND = os.getenv("JOB_LOCK_BACKEND", "database")
+# Workers whose timers fire up to this late still agree on which run they
+# are competing for.
+JOB_CLAIM_GRACE_SECONDS = int(os.getenv("JOB_CLAIM_GRACE_SECONDS", "300"))
+
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class DatabaseJobLock:
+    # Every process inserts a job_runs row for the firing it is about to run;
+    # the unique key on (job, scheduled_for) lets exactly one insert succeed,
+    # and that row doubles as the run history.
+
+    def claim(self, job: str, scheduled_for: datetime) -> Optional[int]:
+        db = SessionLocal()
+        try:
+            run = models.JobRun(
+                job=job, scheduled_for=scheduled_for, owner=_owner(), status=RUNNING, started_at=_utcnow()
+            )
+            db.add(run)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return None
+            return run.id
+        finally:
+            db.close()
+
+    def finish(self, run_id: int, status: str, rows: Optional[int] = None, error: Optional[str] = None):
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(models.JobRun)
+                .where(models.JobRun.id == run_id)
+                .values(status=status, rows=rows, error=error, finished_at=_utcnow())
+            )
+            db.commit()
+        finally:
+            db.close()
+
+
+class LocalJobLock:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = set()
+        self.runs = []
+
+    def claim(self, job: str, scheduled_for: datetime) -> Optional[int]:
+        with self._lock:
+            if (job, scheduled_for) in self._claimed:
+                return None
+            self._claimed.add((job, scheduled_for))
+            self.runs.append({
+                "id": len(self.runs) + 1,
+                "job": job,
+                "scheduled_for": scheduled_for,
+                "owner": _owner(),
+                "status": RUNNING,
+                "started_at": _utcnow(),
+                "finished_at": None,
+                "rows": None,
+                "error": None,
+            })
+            return len(self.runs)
+
+    def finish(self, run_id: int, status: str, rows: Optional[int] = None, error: Optional[str] = None):
+        with self._lock:
+            self.runs[run_id - 1].update(status=status, rows=rows, error=error, finished_at=_utcnow())
+
+
+LOCK_BACKENDS = {
+    "database": DatabaseJobLock,
+    "local": LocalJobLock,
+}
+
+
+def make_lock(backend: str = JOB_LOCK_BACKEND):
+    if backend not in LOCK_BACKENDS:
+        raise ValueError(f"unknown job lock backend {backend!r}, expected one of {sorted(LOCK_BACKENDS)}")
+    return LOCK_BACKENDS[backend]()
+
+
+def scheduled_for(trigger, now: Optional[datetime] = None) -> datetime:
+    # The firing a job belongs to is the trigger's first fire time within the
+    # grace window, so workers whose clocks or event loops lag a little still
+    # compete for the same run. Stored as naive UTC.
+    now = now or datetime.now(trigger.timezone)
+    fire_time = trigger.get_next_fire_time(None, now - timedelta(seconds=JOB_CLAIM_GRACE_SECONDS))
+    return fire_time.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class JobRunner:
+    def __init__(self, lock=None):
+        self.lock = lock if lock is not None else make_lock()
+        self.scheduler = AsyncIOScheduler()
+
+    def add_job(self, name: str, func: Callable, trigger, rows: Optional[Callable] = None):
+        async def run():
+            return await self.run_once(name, func, trigger, rows)
+
+        self.scheduler.add_job(run, trigger, id=name, name=name)
+
+    async def run_once(self, name: str, func: Callable, trigger, rows: Optional[Callable] = None, now=None):
+        slot = scheduled_for(trigger, now)
+        run_id = await run_in_threadpool(self.lock.claim, name, slot)
+        if run_id is None:
+            logger.info("%s for %s already claimed by another worker, skipping", name, slot)
+            return None
+
+        try:
+            result = await metrics.track_job(name, rows)(func)()
+        except Exception as error:
+            logger.exception("%s for %s failed", name, slot)
+            await run_in_threadpool(self.lock.finish, run_id, FAILED, None, repr(error)[:2000])
+            return None
+        await run_in_threadpool(self.lock.finish, run_id, SUCCEEDED, rows(result) if rows is not None else None)
+        return result
+
+    def start(self):
+        self.scheduler.start()
+
+    def shutdown(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
@@ -1,23 +1,30 @@
 import os
 import shutil
-from fastapi.responses import FileResponse
-from collections import defaultdict
-from datetime import date, timedelta
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from datetime import date
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from apscheduler.triggers.cron import CronTrigger
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
-
-import models, schemas, auth
-from database import engine, get_db
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+
+import models, schemas, auth, rollover, calendar_status, completion_buffer, events, export, metrics, pool_metrics, \
+    profiling, progress, queries, rate_limit, response_cache, serialization, sync, timezones
+from database import async_engine, engine, get_db, insert_missing
+from dependencies import CurrentUser, current_user
+from hashing import password_hasher
+from job_runner import JobRunner
+from pagination import PageParams, paginate
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from typing import List
-
-models.Base.metadata.create_all(bind=engine)
+from sqlalchemy import delete, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
 
 app = FastAPI()
 
+# Added first so it runs inside CORS: preflights never reach it and its 429s
+# and 503s still carry CORS headers.
+if rate_limit.RATE_LIMIT_ENABLED:
+    app.add_middleware(rate_limit.RateLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -26,7 +33,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+app.add_middleware(metrics.PrometheusMiddleware)
+
+if profiling.REQUEST_INSTRUMENTATION:
+    profiling.instrument_engines(engine, async_engine.sync_engine)
+    app.add_middleware(profiling.RequestProfilerMiddleware)
+
+TODO_BATCH_LIMIT = 100
 
 # UPLOAD_DIRECTORY = "profile"
 
@@ -34,38 +47,64 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 #     os.makedirs(UPLOAD_DIRECTORY)
 
 
+job_runner = JobRunner()
+
+
 @app.on_event("startup")
 async def startup_event():
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(reset_todos, CronTrigger(hour=0, minute=0))
-    scheduler.add_job(delete_expired_todos, CronTrigger(hour=0, minute=0))
-    scheduler.add_job(get_calendar_status, CronTrigger(hour=0, minute=0))
-    scheduler.start()
+    # Users are rolled over as their own local midnight passes; every quarter
+    # hour also covers the :30 and :45 offset timezones.
+    job_runner.add_job("rollover", roll_over_todos, CronTrigger(minute="*/15"), rows=_batch_rows)
+    job_runner.add_job("refresh_progress", refresh_progress, CronTrigger(hour=1, minute=0, timezone="UTC"),
+                       rows=lambda rows: rows)
+    job_runner.start()
+    if completion_buffer.COMPLETION_WRITE_BEHIND:
+        completion_buffer.buffer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_runner.shutdown()
+    password_hasher.shutdown()
+    await completion_buffer.buffer.stop()
+    await events.hub.close()
+
+
+def _batch_rows(reports):
+    return sum(report.rows for report in reports)
+
+
+async def roll_over_todos():
+    # Buffered completions belong to the day they were made on, so they land
+    # before that day is finalized.
+    await completion_buffer.buffer.flush()
+    reports = await run_in_threadpool(rollover.roll_over)
+    await response_cache.invalidate(
+        (response_cache.TODOS, response_cache.CALENDAR),
+        [user_id for report in reports for user_id in report.user_ids],
+    )
+    return reports
+
 
+async def refresh_progress():
+    return await run_in_threadpool(progress.refresh_snapshot)
 
-async def reset_todos():
-    db = next(get_db())
-    todos = db.query(models.Todo).all()
-    for todo in todos:
-        todo.completed = False
-    db.commit()
-    db.close()
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-async def delete_expired_todos():
-    db = next(get_db())
-    today = date.today()
-    expired_todos = db.query(models.Todo).filter(models.Todo.end_date < today).all()
-    for todo in expired_todos:
-        db.delete(todo)
-    db.commit()
-    db.close()
+
+@app.get("/metrics/json", response_model=dict)
+def metrics_json():
+    return {"db_pool": pool_metrics.snapshot(), "password_hashing": password_hasher.snapshot()}
 
 
 @app.post("/token", response_model=dict)
-def access(token_request: schemas.TokenRequest, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == token_request.username).first()
-    if not user or not auth.verify_password(token_request.password, user.hashed_password):
+async def access(token_request: schemas.TokenRequest, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(queries.user_by_username(token_request.username))
+    user = result.scalars().first()
+    if not user or not await password_hasher.verify_password(token_request.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -90,29 +129,40 @@ def refresh(refresh_token_request: schemas.RefreshTokenRequest):
 
 
 @app.post("/user", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    hashed_password = auth.get_password_hash(user.password)
-    db_user = models.User(username=user.username, hashed_password=hashed_password)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    hashed_password = await password_hasher.get_password_hash(user.password)
+    tz_name = user.timezone or timezones.DEFAULT_TIMEZONE
+    db_user = models.User(
+        username=user.username,
+        hashed_password=hashed_password,
+        timezone=tz_name,
+        rolled_over_on=timezones.today_in(tz_name),
+    )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
+@app.put("/user/timezone", response_model=schemas.UserTimezone)
+async def update_timezone(
+        update_request: schemas.UserTimezone,
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    db_user = await db.get(models.User, user.id)
+    db_user.timezone = update_request.timezone
+    await db.commit()
+    await response_cache.invalidate((response_cache.CALENDAR,), [user.id])
+    return update_request
+
+
 @app.post("/todo", response_model=schemas.Todo)
 async def create_todo(
         todo: schemas.TodoCreate,
-        db: Session = Depends(get_db),
-        token: str = Depends(oauth2_scheme)
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
 ):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
     db_todo = models.Todo(
         title=todo.title,
         start_date=todo.start_date,
@@ -120,222 +170,406 @@ async def create_todo(
         creator_id=user.id
     )
     db.add(db_todo)
-    db.commit()
-    db.refresh(db_todo)
+    await db.run_sync(calendar_status.add_todo, db_todo, user.today())
+    await db.run_sync(sync.stamp, db_todo)
+    await db.commit()
+    await response_cache.invalidate((response_cache.TODOS, response_cache.CALENDAR), [user.id])
+    await db.refresh(db_todo)
     return db_todo
 
 
-@app.get("/todo", response_model=List[schemas.Todo])
-def read_todos(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
+def _check_batch_size(items: list):
+    if len(items) > TODO_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {TODO_BATCH_LIMIT} items per batch")
+
+
+@app.post("/todo/batch", response_model=List[schemas.TodoBatchResult])
+async def create_todos(
+        todos: List[schemas.TodoCreate],
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    _check_batch_size(todos)
+    results = []
+    db_todos = []
+    for index, todo in enumerate(todos):
+        if todo.end_date < todo.start_date:
+            results.append({"index": index, "ok": False, "error": "end_date is before start_date"})
+            continue
+        db_todo = models.Todo(
+            title=todo.title,
+            start_date=todo.start_date,
+            end_date=todo.end_date,
+            completed=False,
+            creator_id=user.id
+        )
+        db_todos.append(db_todo)
+        results.append({"index": index, "ok": True, "todo": db_todo})
+
+    # The ORM flushes the new rows as one multi-row INSERT where the dialect can
+    # return the generated ids, and always in this single transaction.
+    db.add_all(db_todos)
+    await db.run_sync(calendar_status.add_todos, user.id, db_todos, user.today())
+    if db_todos:
+        await db.run_sync(sync.stamp, *db_todos)
+    await db.commit()
+    await response_cache.invalidate((response_cache.TODOS, response_cache.CALENDAR), [user.id])
+    return results
+
+
+@app.put("/todo/complete/batch", response_model=List[schemas.TodoBatchResult])
+async def update_todos(
+        completions: List[schemas.TodoCompletion],
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    _check_batch_size(completions)
+    wanted = {completion.id: completion.completed for completion in completions}
+    result = await db.execute(queries.owned_todos(user.id, list(wanted)))
+    owned = {todo.id: todo for todo in result.scalars()}
+
+    today = user.today()
+    if completion_buffer.COMPLETION_WRITE_BEHIND:
+        for todo_id, todo in owned.items():
+            await completion_buffer.buffer.put(user.id, todo_id, wanted[todo_id], today)
+            todo.completed = wanted[todo_id]
+        return _batch_results(completions, owned)
+
+    changed = await db.run_sync(calendar_status.set_many_completed, user.id, owned, wanted, today)
+    if changed:
+        await db.run_sync(sync.stamp, *(owned[todo_id] for todo_id in changed))
+    await db.commit()
+    await response_cache.invalidate((response_cache.TODOS, response_cache.CALENDAR), [user.id])
+    await events.publish_progress(db, user.id, today, [owned[todo_id] for todo_id in changed])
+    return _batch_results(completions, owned)
+
+
+def _batch_results(completions: List[schemas.TodoCompletion], owned: dict) -> list:
+    return [
+        {"index": index, "ok": True, "todo": owned[completion.id]} if completion.id in owned
+        else {"index": index, "ok": False, "error": "Todo not found"}
+        for index, completion in enumerate(completions)
+    ]
+
+
+@app.get("/todo", response_model=schemas.TodoPage)
+async def read_todos(
+        request: Request,
+        page: PageParams = Depends(),
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    today = user.today()
+    await completion_buffer.buffer.flush_user(user.id)
+
+    async def build():
+        result = await paginate(
+            db, queries.user_todos(user.id, today, *queries.todo_columns(today)), models.Todo.id, page, scalars=False
         )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    todos = db.query(models.Todo).filter(models.Todo.creator_id == user.id).all()
-    return todos
+        return serialization.dumps(serialization.page(result))
+
+    return await response_cache.respond(request, response_cache.TODOS, user.id, build, today)
+
+
+@app.get("/todo/export")
+async def export_todos(
+        kind: Literal["todos", "days"] = "todos",
+        format: Literal["ndjson", "csv"] = "ndjson",
+        start: Optional[date] = Query(None, alias="from"),
+        end: Optional[date] = Query(None, alias="to"),
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    await completion_buffer.buffer.flush_user(user.id)
+    # export.stream reads through its own session; don't hold this one's
+    # connection for the length of the download.
+    await db.close()
+
+    return StreamingResponse(
+        export.stream(kind, format, user.id, user.today(), start, end),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'},
+    )
 
 
 @app.put("/todo/{todo_id}/complete", response_model=schemas.Todo)
-def update_todo(
+async def update_todo(
         todo_id: int,
         todo_update: schemas.TodoUpdate,
-        db: Session = Depends(get_db),
-        token: str = Depends(oauth2_scheme)
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
 ):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-
-    todo = db.query(models.Todo).filter(models.Todo.id == todo_id).first()
+    # Someone else's todo is reported as missing, as in the batch endpoint.
+    todo = (await db.execute(queries.owned_todos(user.id, [todo_id]))).scalar_one_or_none()
 
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
 
-    todo.completed = todo_update.completed
-    db.commit()
-    db.refresh(todo)
+    today = user.today()
+    if completion_buffer.COMPLETION_WRITE_BEHIND:
+        await completion_buffer.buffer.put(user.id, todo.id, todo_update.completed, today)
+        todo.completed = todo_update.completed
+        return todo
+
+    changed = await db.run_sync(calendar_status.set_completed, todo, todo_update.completed, today)
+    if changed:
+        await db.run_sync(sync.stamp, todo)
+    await db.commit()
+    await response_cache.invalidate((response_cache.TODOS, response_cache.CALENDAR), [todo.creator_id])
+    if changed:
+        await events.publish_progress(db, todo.creator_id, today, [todo])
 
     return todo
 
 
+async def _get_group(db: AsyncSession, group_id: int):
+    result = await db.execute(queries.group_with_members(group_id))
+    return result.scalars().first()
+
+
+async def _groups_with_members(db: AsyncSession, group_rows) -> list:
+    members = []
+    if group_rows:
+        result = await db.execute(queries.members_of_groups([group.id for group in group_rows]))
+        members = result.all()
+    return serialization.groups(group_rows, members)
+
+
+async def _invalidate_joined(db_group, *user_ids):
+    # /group/joined embeds each group's member list, so a membership change is
+    # visible to every member of the group, not only to the one who changed.
+    await response_cache.invalidate(
+        (response_cache.JOINED_GROUPS,), [member.id for member in db_group.members] + list(user_ids)
+    )
+
+
+def _update_membership(user_id: int, group_id: int):
+    return update(models.group_membership).where(
+        models.group_membership.c.user_id == user_id, models.group_membership.c.group_id == group_id
+    )
+
+
+async def _is_member(db: AsyncSession, user_id: int, group_id: int) -> bool:
+    result = await db.execute(queries.membership_of(user_id, group_id))
+    return result.first() is not None
+
+
 @app.post("/group", response_model=schemas.Group)
-def create_group(group: schemas.GroupCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def create_group(group: schemas.GroupCreate, db: AsyncSession = Depends(get_db), user: CurrentUser = Depends(current_user)):
     db_group = models.Group(name=group.name, creator_id=user.id)
-    db_group.members.append(user)
     db.add(db_group)
-    db.commit()
-    db.refresh(db_group)
-    return db_group
+    await db.flush()
+    await db.execute(insert(models.group_membership).values(user_id=user.id, group_id=db_group.id))
+    version = await db.run_sync(sync.stamp, db_group)
+    await db.execute(_update_membership(user.id, db_group.id).values(version=version))
+    await db.commit()
+    await response_cache.invalidate((response_cache.JOINED_GROUPS,), [user.id])
+    return await _get_group(db, db_group.id)
 
 
 @app.delete("/group/{group_id}", response_model=schemas.Group)
-def delete_group(group_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    db_group = db.query(models.Group).filter(models.Group.id == group_id).first()
+async def delete_group(group_id: int, db: AsyncSession = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    db_group = await _get_group(db, group_id)
     if db_group is None:
         raise HTTPException(status_code=404, detail="Group not found")
     if db_group.creator_id != user.id:
         raise HTTPException(status_code=403, detail="You do not have permission to delete this group")
-    db.delete(db_group)
-    db.commit()
+    member_ids = [member.id for member in db_group.members]
+    await db.delete(db_group)
+    await db.flush()
+    version = await db.run_sync(sync.stamp)
+    await db.run_sync(sync.bury, version, sync.GROUP, group_id, member_ids)
+    await db.commit()
+    await _invalidate_joined(db_group)
+    await events.hub.publish(events.group_channel(group_id), {"type": events.GROUP_DELETED, "group_id": group_id})
     return db_group
 
 
 @app.post("/group/{group_id}/join", response_model=schemas.Group)
-def join_group(group_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    db_group = db.query(models.Group).filter(models.Group.id == group_id).first()
+async def join_group(group_id: int, db: AsyncSession = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    db_group = await db.get(models.Group, group_id)
     if db_group is None:
         raise HTTPException(status_code=404, detail="Group not found")
-    db_group.members.append(user)
-    db.commit()
-    db.refresh(db_group)
+    if await _is_member(db, user.id, group_id):
+        return await _get_group(db, group_id)
+    # A concurrent join by the same user may have inserted the row already.
+    joined = await db.run_sync(insert_missing, models.group_membership, [{"user_id": user.id, "group_id": group_id}])
+    if joined:
+        version = await db.run_sync(sync.stamp)
+        await db.execute(_update_membership(user.id, group_id).values(version=version))
+    await db.commit()
+    db_group = await _get_group(db, group_id)
+    if not joined:
+        return db_group
+    await _invalidate_joined(db_group)
+    await events.hub.publish(events.group_channel(group_id), {
+        "type": events.MEMBER_JOINED, "group_id": group_id, "user_id": user.id, "username": user.username,
+    })
     return db_group
 
 
 @app.post("/group/{group_id}/leave", response_model=schemas.Group)
-def leave_group(group_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    db_group = db.query(models.Group).filter(models.Group.id == group_id).first()
+async def leave_group(group_id: int, db: AsyncSession = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    db_group = await db.get(models.Group, group_id)
     if db_group is None:
         raise HTTPException(status_code=404, detail="Group not found")
-    db_group.members.remove(user)
-    db.commit()
-    db.refresh(db_group)
+    left = await db.execute(
+        delete(models.group_membership)
+        .where(models.group_membership.c.user_id == user.id, models.group_membership.c.group_id == group_id)
+    )
+    if left.rowcount:
+        # The row is gone, so the group's own version records the change.
+        version = await db.run_sync(sync.stamp, db_group)
+        await db.run_sync(sync.bury, version, sync.GROUP, group_id, [user.id])
+    await db.commit()
+    db_group = await _get_group(db, group_id)
+    await _invalidate_joined(db_group, user.id)
+    if left.rowcount:
+        await events.hub.publish(events.group_channel(group_id), {
+            "type": events.MEMBER_LEFT, "group_id": group_id, "user_id": user.id,
+        })
     return db_group
 
 
 @app.get("/group/joined", response_model=List[schemas.Group])
-def get_joined(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user.groups
+async def get_joined(request: Request, db: AsyncSession = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    async def build():
+        result = await db.execute(queries.joined_groups(user.id, *queries.GROUP_COLUMNS))
+        return serialization.dumps(await _groups_with_members(db, result.all()))
 
+    return await response_cache.respond(request, response_cache.JOINED_GROUPS, user.id, build)
 
-@app.get("/group/not-joined", response_model=List[schemas.Group])
-def get_not_joined(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    joined_groups = [group.id for group in user.groups]
-    not_joined_groups = db.query(models.Group).filter(models.Group.id.notin_(joined_groups)).all()
-    return not_joined_groups
 
+@app.get("/sync", response_model=schemas.SyncChanges)
+async def sync_changes(
+        since: Optional[int] = Query(None, ge=0),
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    # Without `since` this is a full snapshot. Clients apply the deletions
+    # first, then upsert the rows, and send `version` back as the next
+    # `since`. The version is read before the rows, so a change committed in
+    # between is at worst sent twice, never skipped.
+    await completion_buffer.buffer.flush_user(user.id)
+    version = (await db.execute(queries.sync_version())).scalar() or 0
+    todos = await db.execute(queries.changed_todos(user.id, user.today(), since))
+    groups = await db.execute(queries.changed_groups(user.id, since))
+    deleted = {sync.TODO: [], sync.GROUP: []}
+    if since is not None:
+        for kind, entity_id in await db.execute(queries.tombstones_since(user.id, since)):
+            deleted[kind].append(entity_id)
+    return serialization.ORJSONResponse({
+        "version": version,
+        "todos": serialization.rows(todos),
+        "groups": await _groups_with_members(db, groups.all()),
+        "deleted_todos": deleted[sync.TODO],
+        "deleted_groups": deleted[sync.GROUP],
+    })
+
+
+@app.get("/group/not-joined", response_model=schemas.GroupPage)
+async def get_not_joined(
+        page: PageParams = Depends(),
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    result = await paginate(
+        db, queries.not_joined_groups(user.id, *queries.GROUP_COLUMNS), models.Group.id, page, scalars=False
+    )
+    return serialization.ORJSONResponse(serialization.page(result, await _groups_with_members(db, result["items"])))
 
-@app.get("/group/{group_id}/members", response_model=List[schemas.User])
-def get_group_members(group_id: int, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    db_group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    if db_group is None:
+
+@app.get("/group/{group_id}/members", response_model=schemas.UserPage)
+async def get_group_members(
+        group_id: int,
+        page: PageParams = Depends(),
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    if await db.get(models.Group, group_id) is None:
         raise HTTPException(status_code=404, detail="Group not found")
-    return db_group.members
+    result = await paginate(
+        db, queries.group_members(group_id, *queries.USER_COLUMNS), queries.membership.c.user_id, page, "id",
+        scalars=False,
+    )
+    return serialization.ORJSONResponse(serialization.page(result))
+
+
+@app.get("/group/{group_id}/events")
+async def group_events(group_id: int, db: AsyncSession = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    if await db.get(models.Group, group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if not await _is_member(db, user.id, group_id):
+        raise HTTPException(status_code=403, detail="Only members can follow this group")
+    # The stream can stay open for hours; give the connection back to the pool
+    # now rather than when the request's session closes after it.
+    await db.close()
+    return StreamingResponse(
+        events.hub.stream(events.group_channel(group_id), user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/group/{group_id}/progress", response_model=schemas.GroupProgress)
+async def get_group_progress(
+        group_id: int,
+        start: Optional[date] = Query(None, alias="from"),
+        end: Optional[date] = Query(None, alias="to"),
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    if await db.get(models.Group, group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if not await _is_member(db, user.id, group_id):
+        raise HTTPException(status_code=403, detail="Only members can see this group's progress")
+
+    explicit = start is not None or end is not None
+    default_start, default_end = progress.default_window(user.today())
+    start, end = start or default_start, end or default_end
+    if start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (end - start).days >= progress.PROGRESS_MAX_WINDOW_DAYS:
+        raise HTTPException(status_code=400, detail=f"Window is limited to {progress.PROGRESS_MAX_WINDOW_DAYS} days")
+
+    if not explicit:
+        size = (await db.execute(queries.group_size(group_id))).scalar()
+        if size >= progress.PROGRESS_SNAPSHOT_MIN_MEMBERS:
+            rows = (await db.execute(queries.group_progress_snapshot(group_id))).all()
+            snapshot = next((row for row in rows if row.window_start is not None), None)
+            if snapshot is not None:
+                return {
+                    "group_id": group_id,
+                    "start": snapshot.window_start,
+                    "end": snapshot.window_end,
+                    "snapshot": True,
+                    "members": rows,
+                }
+
+    rows = (await db.execute(queries.group_progress(group_id, start, end))).all()
+    return {"group_id": group_id, "start": start, "end": end, "snapshot": False, "members": rows}
 
 
 @app.get("/calendar-status", response_model=List[schemas.CalendarStatus])
-def get_calendar_status(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    user_info = auth.decode_access_token(token)
-    if user_info is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
+async def get_calendar_status(
+        request: Request,
+        start: Optional[date] = Query(None, alias="from"),
+        end: Optional[date] = Query(None, alias="to"),
+        db: AsyncSession = Depends(get_db),
+        user: CurrentUser = Depends(current_user)
+):
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    await completion_buffer.buffer.flush_user(user.id)
+
+    async def build():
+        return response_cache.render(
+            List[schemas.CalendarStatus], await db.run_sync(calendar_status.read, user.id, start, end)
         )
 
-    user = db.query(models.User).filter(models.User.username == user_info["sub"]).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    todos = db.query(models.Todo).filter(models.Todo.creator_id == user.id).all()
-
-    today = date.today()
-    date_status = defaultdict(lambda: "성공")
-
-    for todo in todos:
-        for current_date in range((todo.end_date - todo.start_date).days + 1):
-            day = todo.start_date + timedelta(days=current_date)
-
-            if day > today:
-                date_status[day] = "예정"
-            elif day == today:
-                if not all(todo.completed for todo in todos if todo.start_date <= today <= todo.end_date):
-                    date_status[day] = "도전"
-                else:
-                    date_status[day] = "성공"
-            else:
-                if not todo.completed:
-                    date_status[day] = "실패"
-                else:
-                    date_status[day] = "성공"
-
-    if all(todo.completed for todo in todos if todo.start_date <= today <= todo.end_date):
-        if today in date_status:
-            date_status[today] = "성공"
-
-    calendar_status = [{"date": day, "status": status} for day, status in sorted(date_status.items())]
-    return calendar_status
+    return await response_cache.respond(request, response_cache.CALENDAR, user.id, build, user.today())
 
 
 # @app.post("/profile", response_model=dict)
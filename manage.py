@@ -0,0 +1,50 @@
+import argparse
+import logging
+from datetime import date
+
+import calendar_status
+import query_plans
+from database import SessionLocal, engine
+
+
+def backfill_calendar(args):
+    db = SessionLocal()
+    try:
+        rows = calendar_status.backfill(db, start=args.start, end=args.end, batch_size=args.batch_size)
+    finally:
+        db.close()
+    print(f"calendar_days: {rows} rows written")
+
+
+def explain_queries(args):
+    results = query_plans.explain(engine)
+    for result in results:
+        print(f"{'ok  ' if result.ok else 'FAIL'} {result.label}")
+        for line in result.plan:
+            print(f"       {line}")
+    if not all(result.ok for result in results):
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MiraclePlan maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser(
+        "backfill-calendar", help="rebuild calendar_days from existing todos, keeping days before each user's last rollover"
+    )
+    backfill.add_argument("--from", dest="start", type=date.fromisoformat)
+    backfill.add_argument("--to", dest="end", type=date.fromisoformat)
+    backfill.add_argument("--batch-size", type=int, default=100, help="users rebuilt per transaction")
+    backfill.set_defaults(func=backfill_calendar)
+
+    explain = commands.add_parser("explain-queries", help="EXPLAIN each endpoint's query and flag full scans and sorts")
+    explain.set_defaults(func=explain_queries)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import time
+from functools import wraps
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import pool_metrics
+from hashing import password_hasher
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being handled.")
+
+JOB_DURATION = Histogram(
+    "scheduler_job_duration_seconds",
+    "Scheduled job run time.",
+    ["job"],
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0),
+)
+JOB_ROWS = Counter("scheduler_job_rows_total", "Rows affected by scheduled jobs.", ["job"])
+JOB_LAST_ROWS = Gauge("scheduler_job_last_rows", "Rows affected by the last successful run.", ["job"])
+JOB_FAILURES = Counter("scheduler_job_failures_total", "Scheduled job runs that raised.", ["job"])
+JOB_LAST_SUCCESS = Gauge(
+    "scheduler_job_last_success_timestamp_seconds", "Unix time the job last finished successfully.", ["job"]
+)
+
+EVENT_SUBSCRIBERS = Gauge("event_subscribers", "Open event stream connections in this process.")
+EVENT_OVERFLOWS = Counter(
+    "event_subscriber_overflows_total", "Event stream connections told to resync because they fell behind."
+)
+
+COMPLETIONS_PENDING = Gauge("completions_pending", "Completion changes buffered in this process, not yet written.")
+COMPLETIONS_COALESCED = Counter(
+    "completions_coalesced_total", "Buffered completion changes replaced by a later change to the same todo."
+)
+
+REQUESTS_SHED = Counter(
+    "http_requests_shed_total", "Requests turned away before routing: 'rate' with 429, 'concurrency' with 503.", ["reason"]
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+class PrometheusMiddleware:
+    # Labels by the matched route template (/todo/{todo_id}/complete) rather
+    # than the raw path so the series count stays bounded; the router stores
+    # the matched route on the scope while dispatching.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status_code)
+            ).observe(time.perf_counter() - started)
+
+
+def track_job(job: str, rows=None):
+    # Wraps a scheduled coroutine; `rows` maps its return value to the number
+    # of rows it touched.
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                JOB_FAILURES.labels(job).inc()
+                raise
+            finally:
+                JOB_DURATION.labels(job).observe(time.perf_counter() - started)
+            affected = rows(result) if rows is not None else 0
+            JOB_ROWS.labels(job).inc(affected)
+            JOB_LAST_ROWS.labels(job).set(affected)
+            JOB_LAST_SUCCESS.labels(job).set_to_current_time()
+            return result
+        return wrapper
+    return decorator
+
+
+class _PoolCollector:
+    # Reads the pool and hasher counters at scrape time, so nothing extra runs
+    # on checkout or per request.
+
+    def collect(self):
+        gauges = {
+            name: GaugeMetricFamily(f"db_pool_{name}", help_text, labels=["pool"])
+            for name, help_text in (
+                ("size", "Configured pool size."),
+                ("checked_out", "Connections currently checked out."),
+                ("checked_in", "Idle connections in the pool."),
+                ("overflow", "Connections opened beyond the pool size."),
+                ("wait_seconds_max", "Longest wait for a connection."),
+            )
+        }
+        counters = {
+            name: CounterMetricFamily(f"db_pool_{name}", help_text, labels=["pool"])
+            for name, help_text in (
+                ("checkouts", "Connection checkouts."),
+                ("timeouts", "Checkouts that timed out waiting for a connection."),
+                ("wait_seconds", "Time spent waiting for a connection."),
+                ("connects", "New DBAPI connections opened."),
+                ("closes", "DBAPI connections closed."),
+                ("invalidations", "Connections invalidated."),
+            )
+        }
+        for pool, entry in pool_metrics.snapshot().items():
+            for name, family in gauges.items():
+                if name in entry:
+                    family.add_metric([pool], entry[name])
+            for name, family in counters.items():
+                key = "wait_seconds_total" if name == "wait_seconds" else name
+                if key in entry:
+                    family.add_metric([pool], entry[key])
+        yield from gauges.values()
+        yield from counters.values()
+
+        hashing = password_hasher.snapshot()
+        for name in ("workers", "pending", "max_pending", "wait_seconds_max", "hash_seconds_max"):
+            yield GaugeMetricFamily(f"password_hashing_{name}", f"Password hasher {name}.", value=hashing[name])
+        for name, key in (
+                ("hashes", "count"),
+                ("rejected", "rejected"),
+                ("wait_seconds", "wait_seconds_total"),
+                ("hash_seconds", "hash_seconds_total"),
+        ):
+            yield CounterMetricFamily(f"password_hashing_{name}", f"Password hasher {name}.", value=hashing[key])
+
+
+REGISTRY.register(_PoolCollector())
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
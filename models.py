@@ -1,10 +1,15 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Date, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, Table, Date, DateTime, Index, Text, UniqueConstraint, false
+from sqlalchemy.orm import query_expression, relationship
 from database import Base
+from timezones import DEFAULT_TIMEZONE
 
 group_membership = Table('group_membership', Base.metadata,
-                         Column('user_id', Integer, ForeignKey('users.id')),
-                         Column('group_id', Integer, ForeignKey('groups.id'))
+                         Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
+                         Column('group_id', Integer, ForeignKey('groups.id'), primary_key=True),
+                         # Sync version the user joined at; see sync.py.
+                         Column('version', Integer, nullable=False, default=0, server_default='0'),
+                         Index('ix_group_membership_group_id_user_id', 'group_id', 'user_id'),
+                         Index('ix_group_membership_group_id_version', 'group_id', 'version'),
                          )
 
 
@@ -14,10 +19,17 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(255), unique=True, index=True)
     hashed_password = Column(String(255))
+    timezone = Column(String(64), nullable=False, default=DEFAULT_TIMEZONE, server_default='UTC')
+    # Local date this user's todos were last rolled over to; see rollover.py.
+    rolled_over_on = Column(Date)
     # profile = Column(String(255))
     todos = relationship("Todo", back_populates="creator")
     groups = relationship("Group", secondary=group_membership, back_populates="members")
 
+    __table_args__ = (
+        Index('ix_users_timezone_rolled_over_on', 'timezone', 'rolled_over_on'),
+    )
+
 
 class Todo(Base):
     __tablename__ = 'todos'
@@ -26,9 +38,28 @@ class Todo(Base):
     title = Column(String(255))
     start_date = Column(Date)
     end_date = Column(Date)
-    completed = Column(Boolean, default=False)
     creator_id = Column(Integer, ForeignKey('users.id'))
     creator = relationship("User", back_populates="todos")
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    # Whether the todo has a TodoCompletion for the reader's local today; load
+    # it with with_expression(Todo.completed, queries.completed_on(today)).
+    completed = query_expression(default_expr=false())
+
+    __table_args__ = (
+        Index('ix_todos_creator_id_id', 'creator_id', 'id'),
+        Index('ix_todos_creator_id_start_date_end_date', 'creator_id', 'start_date', 'end_date'),
+        Index('ix_todos_end_date', 'end_date'),
+        Index('ix_todos_creator_id_version', 'creator_id', 'version'),
+    )
+
+
+class TodoCompletion(Base):
+    # One row per todo and local day it was completed on, so nothing has to be
+    # reset when the day changes and past days keep their outcome.
+    __tablename__ = "todo_completions"
+
+    todo_id = Column(Integer, ForeignKey('todos.id', ondelete='CASCADE'), primary_key=True)
+    date = Column(Date, primary_key=True)
 
 
 class Group(Base):
@@ -37,8 +68,81 @@ class Group(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), unique=True, index=True)
     creator_id = Column(Integer, ForeignKey('users.id'))
-    members = relationship("User", secondary=group_membership, back_populates="groups")
+    members = relationship("User", secondary=group_membership, back_populates="groups",
+                           order_by=group_membership.c.user_id)
     creator = relationship("User", back_populates="created_groups")
+    # Also bumped when a member leaves, since the member list is part of the
+    # group as clients see it.
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+
+
+class CalendarDay(Base):
+    __tablename__ = "calendar_days"
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    date = Column(Date, primary_key=True, index=True)
+    success_count = Column(Integer, nullable=False, default=0)
+    fail_count = Column(Integer, nullable=False, default=0)
+    scheduled_count = Column(Integer, nullable=False, default=0)
+    challenge_count = Column(Integer, nullable=False, default=0)
+
+
+
+class MemberProgress(Base):
+    # Nightly snapshot of progress.member_stats over the default window, read
+    # by GET /group/{id}/progress for large groups.
+    __tablename__ = "member_progress"
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    window_start = Column(Date, nullable=False)
+    window_end = Column(Date, nullable=False)
+    completed = Column(Integer, nullable=False, default=0)
+    missed = Column(Integer, nullable=False, default=0)
+    open = Column(Integer, nullable=False, default=0)
+    streak = Column(Integer, nullable=False, default=0)
+
+
+class JobRun(Base):
+    __tablename__ = "job_runs"
+
+    id = Column(Integer, primary_key=True)
+    job = Column(String(100), nullable=False)
+    scheduled_for = Column(DateTime, nullable=False)
+    owner = Column(String(255))
+    status = Column(String(20), nullable=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    rows = Column(Integer)
+    error = Column(Text)
+
+    __table_args__ = (
+        # Claiming a run is inserting this row; the key makes it single-winner.
+        UniqueConstraint('job', 'scheduled_for', name='uq_job_runs_job_scheduled_for'),
+    )
+
+
+class SyncClock(Base):
+    # A single row holding the last sync version handed out.
+    __tablename__ = "sync_clock"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class SyncTombstone(Base):
+    # Tells `user_id` that `kind` row `entity_id` is gone for them as of
+    # `version`: a deleted or expired todo, or a group deleted or left.
+    __tablename__ = "sync_tombstones"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    version = Column(Integer, nullable=False)
+    kind = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_sync_tombstones_user_id_version', 'user_id', 'version'),
+    )
 
 
 User.created_groups = relationship("Group", back_populates="creator")
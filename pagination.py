@@ -0,0 +1,52 @@
+import base64
+import json
+from typing import Optional
+
+from fastapi import HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class PageParams:
+    def __init__(
+            self,
+            cursor: Optional[str] = None,
+            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.cursor = cursor
+        self.limit = limit
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+
+async def paginate(db: AsyncSession, query, key, page: PageParams, attribute: Optional[str] = None,
+                   scalars: bool = True) -> dict:
+    # Keyset pagination on a unique, indexed `key`: the cursor carries the last
+    # key returned and the next page starts strictly after it, so every page
+    # costs one index range scan no matter how deep the client has paged.
+    # `attribute` names the item attribute holding the key when it differs
+    # from the column name (e.g. ordering by a join table's column). With
+    # `scalars=False` the items are the result rows rather than entities.
+    if page.cursor is not None:
+        query = query.where(key > decode_cursor(page.cursor))
+    result = await db.execute(query.order_by(key).limit(page.limit + 1))
+    items = (result.scalars() if scalars else result).all()
+    next_cursor = None
+    if len(items) > page.limit:
+        items = items[:page.limit]
+        next_cursor = encode_cursor(getattr(items[-1], attribute or key.key))
+    return {"items": items, "next_cursor": next_cursor}
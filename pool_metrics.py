@@ -0,0 +1,107 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolStats:
+    def __init__(self):
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float, timed_out: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class _WaitTimingMixin:
+    # QueuePool._do_get is where a caller blocks until a connection frees up
+    # or the overflow allows a new one, so timing it gives the pool wait.
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - started, timed_out)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(_WaitTimingMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+_pools = {}
+
+
+def instrument(name: str, engine):
+    stats = PoolStats()
+    engine.pool.stats = stats
+    _pools[name] = engine
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        stats.increment("connects")
+
+    @event.listens_for(engine, "close")
+    def _close(dbapi_connection, connection_record):
+        stats.increment("closes")
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidate(dbapi_connection, connection_record, exception):
+        stats.increment("invalidations")
+
+    return engine
+
+
+def snapshot() -> dict:
+    pools = {}
+    for name, engine in _pools.items():
+        pool = engine.pool
+        stats = getattr(pool, "stats", None)
+        entry = {"class": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+            )
+        if stats is not None:
+            entry.update(
+                checkouts=stats.checkouts,
+                timeouts=stats.timeouts,
+                wait_seconds_total=stats.wait_seconds_total,
+                wait_seconds_max=stats.wait_seconds_max,
+                connects=stats.connects,
+                closes=stats.closes,
+                invalidations=stats.invalidations,
+            )
+        pools[name] = entry
+    return pools
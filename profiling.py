@@ -0,0 +1,175 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+logger = logging.getLogger("miracleplan.requests")
+
+REQUEST_INSTRUMENTATION = os.getenv("REQUEST_INSTRUMENTATION", "false").lower() in ("1", "true", "yes")
+# Requests slower than this are profiled and saved to PROFILE_DIR; unset disables profiling.
+SLOW_REQUEST_PROFILE_MS = float(os.getenv("SLOW_REQUEST_PROFILE_MS", "0")) or None
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats.get()
+    started = conn.info.get("query_started")
+    if stats is None or not started:
+        return
+    stats.queries += 1
+    stats.db_seconds += time.perf_counter() - started.pop()
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def instrument_engines(*engines):
+    # Pass sync engines; for an AsyncEngine use its .sync_engine.
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+class _CProfileSession:
+    # cProfile hooks the whole thread, so concurrent requests on the event loop
+    # cannot each have their own profiler; only one request is profiled at a time.
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.profiler = None
+
+    def start(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            return False
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        return True
+
+    def stop(self):
+        self.profiler.disable()
+        self._lock.release()
+
+    def save(self, path: str) -> str:
+        path += ".prof"
+        self.profiler.dump_stats(path)
+        return path
+
+
+class _PyinstrumentSession:
+    def __init__(self):
+        self.profiler = Profiler(async_mode="enabled")
+
+    def start(self) -> bool:
+        self.profiler.start()
+        return True
+
+    def stop(self):
+        self.profiler.stop()
+
+    def save(self, path: str) -> str:
+        path += ".html"
+        with open(path, "w") as f:
+            f.write(self.profiler.output_html())
+        return path
+
+
+class RequestProfilerMiddleware:
+    # Records SQL statement count, DB time and total handler time per request,
+    # returns them as Server-Timing / X-DB-Query-Count headers, logs them as a
+    # JSON line, and saves a profile of requests slower than `slow_ms`.
+
+    def __init__(self, app, slow_ms: Optional[float] = SLOW_REQUEST_PROFILE_MS, profile_dir: str = PROFILE_DIR):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.profile_dir = profile_dir
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+
+        session = None
+        if self.slow_ms is not None:
+            session = _PyinstrumentSession() if Profiler is not None else _CProfileSession()
+            if not session.start():
+                session = None
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", (
+                    f"db;dur={stats.db_seconds * 1000:.2f}, app;dur={elapsed_ms:.2f}"
+                ).encode()))
+                headers.append((b"x-db-query-count", str(stats.queries).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _request_stats.reset(token)
+            profile_path = None
+            if session is not None:
+                session.stop()
+                if elapsed_ms >= self.slow_ms:
+                    profile_path = self._save_profile(session, scope)
+            logger.info(json.dumps({
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status_code,
+                "duration_ms": round(elapsed_ms, 2),
+                "db_queries": stats.queries,
+                "db_ms": round(stats.db_seconds * 1000, 2),
+                "profile": profile_path,
+            }))
+
+    def _save_profile(self, session, scope) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        now = time.time()
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}-" \
+               f"{scope['method']}{scope['path'].replace('/', '_')}"
+        return session.save(os.path.join(self.profile_dir, name))
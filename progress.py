@@ -0,0 +1,57 @@
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import Date, delete, insert, literal, select
+from sqlalchemy.orm import Session
+
+import models
+import queries
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_WINDOW_DAYS = int(os.getenv("PROGRESS_WINDOW_DAYS", "30"))
+# Groups at least this large are served from the nightly member_progress
+# snapshot when no window is given.
+PROGRESS_SNAPSHOT_MIN_MEMBERS = int(os.getenv("PROGRESS_SNAPSHOT_MIN_MEMBERS", "50"))
+PROGRESS_MAX_WINDOW_DAYS = 366
+PROGRESS_BATCH_SIZE = int(os.getenv("PROGRESS_BATCH_SIZE", "500"))
+
+
+def default_window(today: date) -> Tuple[date, date]:
+    # The last PROGRESS_WINDOW_DAYS finished days; today is still open.
+    return today - timedelta(days=PROGRESS_WINDOW_DAYS), today - timedelta(days=1)
+
+
+def refresh_snapshot(today: Optional[date] = None, batch_size: int = PROGRESS_BATCH_SIZE) -> int:
+    # Rebuilds member_progress for every user, batch_size users per
+    # transaction, each batch as one INSERT ... SELECT over the aggregate.
+    today = today or datetime.now(timezone.utc).date()
+    start, end = default_window(today)
+    progress = models.MemberProgress.__table__
+    rows = 0
+    last_id = 0
+    db: Session = SessionLocal()
+    try:
+        while True:
+            user_ids = db.execute(queries.users_after(last_id, batch_size)).scalars().all()
+            if not user_ids:
+                break
+            stats = queries.users_progress(user_ids, start, end).subquery()
+            db.execute(delete(progress).where(progress.c.user_id.in_(user_ids)))
+            result = db.execute(insert(progress).from_select(
+                ["user_id", "window_start", "window_end", "completed", "missed", "open", "streak"],
+                select(
+                    stats.c.user_id, literal(start, Date), literal(end, Date),
+                    stats.c.completed, stats.c.missed, stats.c.open, stats.c.streak,
+                ),
+            ))
+            db.commit()
+            rows += result.rowcount
+            last_id = user_ids[-1]
+    finally:
+        db.close()
+    logger.info("member_progress refreshed for %s..%s, %d rows", start, end, rows)
+    return rows
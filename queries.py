@@ -0,0 +1,329 @@
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import selectinload, with_expression
+
+import models
+
+membership = models.group_membership
+days = models.CalendarDay.__table__
+completions = models.TodoCompletion.__table__
+
+
+def completed_on(today: date):
+    # One primary-key probe into todo_completions per todo.
+    return (
+        select(completions.c.todo_id)
+        .where(completions.c.todo_id == models.Todo.id, completions.c.date == today)
+        .exists()
+        .label("completed")
+    )
+
+
+# Columns of schemas.Todo / Group / User in field order, for the list
+# endpoints that serialize rows directly instead of validating ORM objects.
+def todo_columns(today: date):
+    return (
+        models.Todo.title, models.Todo.start_date, models.Todo.end_date,
+        models.Todo.id, models.Todo.creator_id, completed_on(today),
+    )
+
+
+GROUP_COLUMNS = (models.Group.name, models.Group.id, models.Group.creator_id)
+USER_COLUMNS = (models.User.username, models.User.id)
+
+
+def user_by_username(username: str):
+    return select(models.User).where(models.User.username == username)
+
+
+def user_todos(user_id: int, today: date, *columns):
+    query = select(*(columns or (models.Todo,))).where(models.Todo.creator_id == user_id)
+    return query if columns else query.options(with_expression(models.Todo.completed, completed_on(today)))
+
+
+def owned_todos(user_id: int, todo_ids):
+    return select(models.Todo).where(models.Todo.id.in_(todo_ids), models.Todo.creator_id == user_id)
+
+
+def todos_by_id(todo_ids):
+    return select(models.Todo).where(models.Todo.id.in_(todo_ids))
+
+
+def completed_todos(todo_ids, today: date):
+    return select(completions.c.todo_id).where(completions.c.todo_id.in_(todo_ids), completions.c.date == today)
+
+
+def group_with_members(group_id: int):
+    return (
+        select(models.Group)
+        .options(selectinload(models.Group.members))
+        .where(models.Group.id == group_id)
+        .execution_options(populate_existing=True)
+    )
+
+
+def membership_of(user_id: int, group_id: int):
+    return select(membership.c.group_id).where(membership.c.user_id == user_id, membership.c.group_id == group_id)
+
+
+def user_group_ids(user_id: int):
+    return select(membership.c.group_id).where(membership.c.user_id == user_id)
+
+
+def _with_members(query, columns):
+    return query if columns else query.options(selectinload(models.Group.members))
+
+
+def joined_groups(user_id: int, *columns):
+    return _with_members(
+        select(*(columns or (models.Group,)))
+        .join(membership, membership.c.group_id == models.Group.id)
+        .where(membership.c.user_id == user_id),
+        columns,
+    )
+
+
+def not_joined_groups(user_id: int, *columns):
+    return _with_members(
+        select(*(columns or (models.Group,)))
+        .outerjoin(membership, and_(membership.c.group_id == models.Group.id, membership.c.user_id == user_id))
+        .where(membership.c.user_id.is_(None)),
+        columns,
+    )
+
+
+def group_members(group_id: int, *columns):
+    return (
+        select(*(columns or (models.User,)))
+        .join(membership, membership.c.user_id == models.User.id)
+        .where(membership.c.group_id == group_id)
+    )
+
+
+def members_of_groups(group_ids):
+    # Row form of selectinload(Group.members), in the relationship's order.
+    return (
+        select(membership.c.group_id, *USER_COLUMNS)
+        .join(models.User, models.User.id == membership.c.user_id)
+        .where(membership.c.group_id.in_(group_ids))
+        .order_by(membership.c.group_id, membership.c.user_id)
+    )
+
+
+def calendar_days(user_id: int, start: Optional[date] = None, end: Optional[date] = None):
+    query = select(days).where(days.c.user_id == user_id)
+    if start is not None:
+        query = query.where(days.c.date >= start)
+    if end is not None:
+        query = query.where(days.c.date <= end)
+    return query.order_by(days.c.date)
+
+
+def _todo_window(query, start: Optional[date], end: Optional[date]):
+    if start is not None:
+        query = query.where(models.Todo.end_date >= start)
+    if end is not None:
+        query = query.where(models.Todo.start_date <= end)
+    return query
+
+
+def todo_creators_in_window(last_id: int, limit: int, start: Optional[date] = None, end: Optional[date] = None):
+    return _todo_window(
+        select(models.Todo.creator_id)
+        .where(models.Todo.creator_id > last_id)
+        .distinct()
+        .order_by(models.Todo.creator_id)
+        .limit(limit),
+        start, end,
+    )
+
+
+def todos_in_window(user_ids, start: Optional[date] = None, end: Optional[date] = None):
+    return _todo_window(
+        select(
+            models.Todo.creator_id, models.Todo.id, models.Todo.start_date, models.Todo.end_date,
+            models.User.timezone, models.User.rolled_over_on,
+        )
+        .join(models.User, models.User.id == models.Todo.creator_id)
+        .where(models.Todo.creator_id.in_(user_ids))
+        .order_by(models.Todo.creator_id),
+        start, end,
+    )
+
+
+def completions_in_window(user_ids, start: Optional[date] = None, end: Optional[date] = None):
+    query = (
+        select(completions.c.todo_id, completions.c.date)
+        .join(models.Todo, models.Todo.id == completions.c.todo_id)
+        .where(models.Todo.creator_id.in_(user_ids))
+    )
+    if start is not None:
+        query = query.where(completions.c.date >= start)
+    if end is not None:
+        query = query.where(completions.c.date <= end)
+    return query
+
+
+def todo_export(user_id: int, today: date, start: Optional[date] = None, end: Optional[date] = None):
+    return _todo_window(
+        select(
+            models.Todo.id, models.Todo.title, models.Todo.start_date, models.Todo.end_date, completed_on(today),
+        )
+        .where(models.Todo.creator_id == user_id)
+        # Follows ix_todos_creator_id_start_date_end_date, so a windowed export
+        # streams in index order instead of being sorted up front.
+        .order_by(models.Todo.start_date, models.Todo.end_date, models.Todo.id),
+        start, end,
+    )
+
+
+def user_timezones():
+    return select(models.User.timezone).distinct()
+
+
+def users_due_for_rollover(timezone: str, today: date, limit: int):
+    # Rolled-over users leave the (timezone, rolled_over_on < today) range, so
+    # repeating this until it comes back empty walks only the users still due.
+    return (
+        select(models.User.id)
+        .where(
+            models.User.timezone == timezone,
+            or_(models.User.rolled_over_on.is_(None), models.User.rolled_over_on < today),
+        )
+        .limit(limit)
+    )
+
+
+def _member_stats(members, start: date, end: date):
+    # Per-user totals over calendar_days in [start, end] for the user ids in
+    # the `members` subquery. The streak counts fully completed days after the
+    # user's last missed day in the window; days with nothing scheduled
+    # neither extend nor break it.
+    window = days.c.date.between(start, end)
+    last_miss = (
+        select(days.c.user_id, func.max(case((days.c.fail_count > 0, days.c.date))).label("last_miss"))
+        .join(members, members.c.user_id == days.c.user_id)
+        .where(window)
+        .group_by(days.c.user_id)
+        .subquery()
+    )
+    done_day = and_(
+        days.c.fail_count == 0, days.c.challenge_count == 0, days.c.scheduled_count == 0, days.c.success_count > 0,
+        or_(last_miss.c.last_miss.is_(None), days.c.date > last_miss.c.last_miss),
+    )
+    return (
+        select(
+            members.c.user_id,
+            func.coalesce(func.sum(days.c.success_count), 0).label("completed"),
+            func.coalesce(func.sum(days.c.fail_count), 0).label("missed"),
+            func.coalesce(func.sum(days.c.challenge_count + days.c.scheduled_count), 0).label("open"),
+            func.count(case((done_day, 1))).label("streak"),
+        )
+        .select_from(members)
+        .outerjoin(days, and_(days.c.user_id == members.c.user_id, window))
+        .outerjoin(last_miss, last_miss.c.user_id == members.c.user_id)
+        .group_by(members.c.user_id)
+    )
+
+
+def _leaderboard(query):
+    return query.order_by(query.selected_columns.streak.desc(), query.selected_columns.completed.desc(),
+                          query.selected_columns.user_id)
+
+
+def group_progress(group_id: int, start: date, end: date):
+    members = select(membership.c.user_id).where(membership.c.group_id == group_id).subquery()
+    stats = _member_stats(members, start, end).subquery()
+    return _leaderboard(
+        select(stats.c.user_id, models.User.username, stats.c.completed, stats.c.missed, stats.c.open,
+               stats.c.streak)
+        .join(models.User, models.User.id == stats.c.user_id)
+    )
+
+
+def users_progress(user_ids, start: date, end: date):
+    return _member_stats(
+        select(models.User.id.label("user_id")).where(models.User.id.in_(user_ids)).subquery(), start, end
+    )
+
+
+def group_progress_snapshot(group_id: int):
+    progress = models.MemberProgress.__table__
+    return _leaderboard(
+        select(
+            membership.c.user_id, models.User.username,
+            func.coalesce(progress.c.completed, 0).label("completed"),
+            func.coalesce(progress.c.missed, 0).label("missed"),
+            func.coalesce(progress.c.open, 0).label("open"),
+            func.coalesce(progress.c.streak, 0).label("streak"),
+            progress.c.window_start, progress.c.window_end,
+        )
+        .join(models.User, models.User.id == membership.c.user_id)
+        .outerjoin(progress, progress.c.user_id == membership.c.user_id)
+        .where(membership.c.group_id == group_id)
+    )
+
+
+def group_size(group_id: int):
+    return select(func.count()).select_from(membership).where(membership.c.group_id == group_id)
+
+
+def users_after(last_id: int, limit: int):
+    return select(models.User.id).where(models.User.id > last_id).order_by(models.User.id).limit(limit)
+
+
+def sync_version():
+    return select(models.SyncClock.version).where(models.SyncClock.id == 1)
+
+
+def changed_todos(user_id: int, today: date, since: Optional[int] = None):
+    query = user_todos(user_id, today, *todo_columns(today))
+    if since is not None:
+        query = query.where(models.Todo.version > since)
+    return query
+
+
+def changed_groups(user_id: int, since: Optional[int] = None):
+    # The user's groups that changed, gained a member (the user included) or
+    # lost one since `since`.
+    query = joined_groups(user_id, *GROUP_COLUMNS)
+    if since is not None:
+        joins = membership.alias("joins")
+        query = query.where(or_(
+            models.Group.version > since,
+            select(joins.c.group_id).where(joins.c.group_id == models.Group.id, joins.c.version > since).exists(),
+        ))
+    return query
+
+
+def tombstones_since(user_id: int, since: Optional[int] = None):
+    tombstones = models.SyncTombstone
+    query = select(tombstones.kind, tombstones.entity_id).where(tombstones.user_id == user_id)
+    if since is not None:
+        query = query.where(tombstones.version > since)
+    return query.order_by(tombstones.version)
+
+
+def expired_todos(user_ids, today: date, *columns):
+    return select(*(columns or (models.Todo.id,))).where(
+        models.Todo.creator_id.in_(user_ids), models.Todo.end_date < today
+    )
+
+
+def completed_since_rollover(user_ids, today: date):
+    # Todos completed on a day the user has since left behind; their
+    # `completed` reads false from `today` on.
+    return (
+        select(models.Todo.id)
+        .join(models.User, models.User.id == models.Todo.creator_id)
+        .where(
+            models.Todo.creator_id.in_(user_ids),
+            select(completions.c.todo_id).where(
+                completions.c.todo_id == models.Todo.id,
+                completions.c.date >= models.User.rolled_over_on,
+                completions.c.date < today,
+            ).exists(),
+        )
+    )
@@ -0,0 +1,123 @@
+from datetime import date, timedelta
+from typing import List, NamedTuple, Tuple
+
+from sqlalchemy import text
+
+import models
+import queries
+from pagination import DEFAULT_PAGE_SIZE
+
+
+class PlannedQuery(NamedTuple):
+    label: str
+    statement: object
+    # Tables this query is expected to read in full, e.g. paging over every group.
+    allowed_scans: Tuple[str, ...] = ()
+    # Queries ordered by computed values, e.g. a leaderboard over one group's
+    # members, have to sort; the input is bounded by the WHERE clause.
+    allow_sort: bool = False
+
+
+class PlanResult(NamedTuple):
+    label: str
+    plan: List[str]
+    full_scans: List[str]
+    sorts: bool
+    ok: bool
+
+
+def endpoint_queries(today: date) -> List[PlannedQuery]:
+    user_id, group_id = 1, 1
+    month_start, month_end = today.replace(day=1), today.replace(day=1) + timedelta(days=31)
+    return [
+        PlannedQuery("POST /token", queries.user_by_username("sample")),
+        PlannedQuery(
+            "GET /todo",
+            queries.user_todos(user_id, today, *queries.todo_columns(today))
+            .order_by(models.Todo.id)
+            .limit(DEFAULT_PAGE_SIZE + 1),
+        ),
+        PlannedQuery("GET /todo/export", queries.todo_export(user_id, today)),
+        PlannedQuery("GET /todo/export?from&to", queries.todo_export(user_id, today, month_start, month_end)),
+        PlannedQuery("GET /todo/export?kind=days", queries.calendar_days(user_id)),
+        PlannedQuery("PUT /todo/complete/batch", queries.owned_todos(user_id, [1, 2, 3])),
+        PlannedQuery("PUT /todo/complete/batch completions", queries.completed_todos([1, 2, 3], today)),
+        PlannedQuery("PUT /todo/{id}/complete groups to notify", queries.user_group_ids(user_id)),
+        PlannedQuery("completion buffer flush", queries.todos_by_id([1, 2, 3])),
+        PlannedQuery("GET /group/joined", queries.joined_groups(user_id, *queries.GROUP_COLUMNS)),
+        PlannedQuery("GET /group/joined members", queries.members_of_groups([1, 2, 3])),
+        PlannedQuery(
+            "GET /group/not-joined",
+            queries.not_joined_groups(user_id).order_by(models.Group.id).limit(DEFAULT_PAGE_SIZE + 1),
+            allowed_scans=("groups",),
+        ),
+        PlannedQuery(
+            "GET /group/{id}/members",
+            queries.group_members(group_id).order_by(queries.membership.c.user_id).limit(DEFAULT_PAGE_SIZE + 1),
+        ),
+        PlannedQuery("POST /group/{id}/join", queries.membership_of(user_id, group_id)),
+        PlannedQuery(
+            "GET /group/{id}/progress",
+            queries.group_progress(group_id, month_start, month_end),
+            allow_sort=True,
+        ),
+        PlannedQuery("GET /group/{id}/progress snapshot", queries.group_progress_snapshot(group_id), allow_sort=True),
+        PlannedQuery("GET /sync todos", queries.changed_todos(user_id, today, 100)),
+        PlannedQuery("GET /sync groups", queries.changed_groups(user_id, 100)),
+        PlannedQuery("GET /sync tombstones", queries.tombstones_since(user_id, 100)),
+        PlannedQuery("GET /calendar-status", queries.calendar_days(user_id, month_start, month_end)),
+        PlannedQuery(
+            "backfill-calendar users",
+            queries.todo_creators_in_window(0, 100, month_start, month_end),
+        ),
+        PlannedQuery("backfill-calendar todos", queries.todos_in_window([1, 2, 3], month_start, month_end)),
+        PlannedQuery(
+            "backfill-calendar completions", queries.completions_in_window([1, 2, 3], month_start, month_end)
+        ),
+        PlannedQuery("rollover timezones", queries.user_timezones()),
+        PlannedQuery("rollover due users", queries.users_due_for_rollover("UTC", today, 500)),
+        PlannedQuery("rollover expired todos", queries.expired_todos([1, 2, 3], today)),
+        PlannedQuery("rollover completed todos", queries.completed_since_rollover([1, 2, 3], today)),
+    ]
+
+
+def _sqlite_plan(connection, sql):
+    rows = connection.execute(text("EXPLAIN QUERY PLAN " + sql)).all()
+    plan = [row[-1] for row in rows]
+    # "SCAN t" is a full table scan; "SCAN t USING [COVERING] INDEX i" walks an index.
+    scans = [line.split()[1] for line in plan if line.startswith("SCAN ") and "INDEX" not in line]
+    sorts = any("TEMP B-TREE" in line for line in plan)
+    return plan, scans, sorts
+
+
+def _mysql_plan(connection, sql):
+    rows = connection.execute(text("EXPLAIN " + sql)).mappings().all()
+    plan = [
+        f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {row.get('Extra') or ''}".strip()
+        for row in rows
+    ]
+    scans = [row["table"] for row in rows if row["type"] == "ALL"]
+    sorts = any("filesort" in (row.get("Extra") or "") for row in rows)
+    return plan, scans, sorts
+
+
+def explain(engine, today: date = None) -> List[PlanResult]:
+    today = today or date.today()
+    explainers = {"sqlite": _sqlite_plan, "mysql": _mysql_plan}
+    explainer = explainers.get(engine.dialect.name)
+    if explainer is None:
+        raise ValueError(f"no query plan support for {engine.dialect.name}")
+
+    tables = models.Base.metadata.tables
+    results = []
+    with engine.connect() as connection:
+        for query in endpoint_queries(today):
+            sql = str(query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            plan, scans, sorts = explainer(connection, sql)
+            # Scans of derived tables (materialized subqueries) only read rows
+            # the subquery already produced.
+            unexpected = [table for table in scans if table in tables and table not in query.allowed_scans]
+            results.append(PlanResult(
+                query.label, plan, scans, sorts, not unexpected and (query.allow_sort or not sorts)
+            ))
+    return results
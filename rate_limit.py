@@ -0,0 +1,212 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+import auth
+import metrics
+import redis_client
+from database import DB_MAX_OVERFLOW, DB_POOL_SIZE
+from dependencies import token_cache
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Unset keeps buckets in process, so each worker allows the full rate;
+# "redis://..." shares them between workers and "fake://..." uses
+# redis_client.FakeRedis, an in-memory stand-in for tests.
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+# Signed-in clients are limited by user, everyone else by address.
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "10"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "50"))
+RATE_LIMIT_IP_PER_SECOND = float(os.getenv("RATE_LIMIT_IP_PER_SECOND", "5"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "30"))
+RATE_LIMIT_KEYS = int(os.getenv("RATE_LIMIT_KEYS", "100000"))
+# Requests this process handles at once before it answers 503, a few per
+# pooled connection so a burst queues briefly instead of for DB_POOL_TIMEOUT.
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", str((DB_POOL_SIZE + DB_MAX_OVERFLOW) * 4)))
+
+# Tokens a request costs; everything else costs 1. bcrypt makes /token and
+# sign-up the most expensive, then the calendar's range reads and exports.
+ROUTE_COSTS = {
+    "/token": 10,
+    "/user": 10,
+    "/calendar-status": 5,
+    "/todo/export": 5,
+}
+EXEMPT_PATHS = {"/metrics", "/metrics/json"}
+
+
+def _take(tokens: float, at: float, now: float, cost: float, rate: float, burst: float) -> Tuple[float, float]:
+    # Refills the bucket for the time since `at` and spends `cost` if it is
+    # there. Returns the new level and how long the caller must wait, 0 if
+    # the request may go ahead. TOKEN_BUCKET is the same in Lua.
+    tokens = min(burst, tokens + max(0.0, now - at) * rate)
+    cost = min(cost, burst)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+TOKEN_BUCKET = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = math.min(burst, (tonumber(state[1]) or burst) + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+cost = math.min(cost, burst)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+def _lua_number(value: Optional[bytes], default: float) -> float:
+    return default if value is None else float(value)
+
+
+def _lua_string(number: float) -> str:
+    # Lua 5.1's tostring(), which keeps 14 significant digits.
+    return "%.14g" % number
+
+
+def _token_bucket(client, keys, args):
+    # TOKEN_BUCKET line for line, for redis_client.FakeRedis.
+    rate, burst, cost = (float(arg) for arg in args)
+    seconds, micros = client.time()
+    now = seconds + micros / 1000000
+    state = client.hmget(keys[0], "tokens", "at")
+    tokens = min(burst, _lua_number(state[0], burst) + max(0, now - _lua_number(state[1], now)) * rate)
+    cost = min(cost, burst)
+    wait = 0
+    if tokens >= cost:
+        tokens = tokens - cost
+    else:
+        wait = (cost - tokens) / rate
+    client.hset(keys[0], mapping={"tokens": _lua_string(tokens), "at": _lua_string(now)})
+    client.expire(keys[0], math.ceil(burst / rate) + 1)
+    return _lua_string(wait)
+
+
+redis_client.register(TOKEN_BUCKET, _token_bucket)
+
+
+class LocalRateBackend:
+    def __init__(self, maxsize: int = RATE_LIMIT_KEYS, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        now = self.clock()
+        with self._lock:
+            tokens, at = self._buckets.get(key, (burst, now))
+            tokens, wait = _take(tokens, at, now, cost, rate, burst)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # An evicted bucket comes back full, which only ever errs towards
+            # letting a request through.
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisRateBackend:
+    def __init__(self, client):
+        self.client = client
+
+    async def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        wait = await self.client.eval(TOKEN_BUCKET, 1, f"ratelimit:{key}", rate, burst, cost)
+        return float(wait)
+
+
+def make_backend(url: Optional[str] = RATE_LIMIT_URL):
+    if not url:
+        return LocalRateBackend()
+    return RedisRateBackend(redis_client.connect(url, "RATE_LIMIT_URL"))
+
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token if scheme.lower() == "bearer" and token else None
+    return None
+
+
+def client_key(scope) -> Tuple[str, bool]:
+    # The user a valid access token names, else the peer address. Only the
+    # signature is checked here; whether the user still exists is left to
+    # the route.
+    token = _bearer_token(scope)
+    if token:
+        user = token_cache.get(token)
+        if user is not None:
+            return f"user:{user.username}", True
+        payload = auth.decode_access_token(token)
+        if payload and payload.get("sub"):
+            return f"user:{payload['sub']}", True
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}", False
+
+
+class RateLimitMiddleware:
+    # Admission control ahead of routing: a per-process cap on concurrent
+    # requests answered with 503, then a token bucket per client answered
+    # with 429. Both set Retry-After. Event streams stay open indefinitely,
+    # so they pay for connecting but don't hold a slot.
+
+    def __init__(self, app, backend=None, max_concurrent: int = MAX_CONCURRENT_REQUESTS):
+        self.app = app
+        self.backend = backend if backend is not None else make_backend()
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        holds_slot = not path.endswith("/events")
+        if holds_slot:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                metrics.REQUESTS_SHED.labels("concurrency").inc()
+                await _reject(status.HTTP_503_SERVICE_UNAVAILABLE, "Server is busy, please retry shortly", 1)(
+                    scope, receive, send
+                )
+                return
+            self.in_flight += 1
+        try:
+            key, signed_in = client_key(scope)
+            rate, burst = (
+                (RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST) if signed_in else (RATE_LIMIT_IP_PER_SECOND, RATE_LIMIT_IP_BURST)
+            )
+            try:
+                wait = await self.backend.take(key, ROUTE_COSTS.get(path, 1), rate, burst)
+            except Exception:
+                # A shared backend that is down must not take the API with it.
+                logger.exception("rate limit backend failed, letting the request through")
+                wait = 0.0
+            if wait:
+                metrics.REQUESTS_SHED.labels("rate").inc()
+                await _reject(status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests", wait)(scope, receive, send)
+                return
+            await self.app(scope, receive, send)
+        finally:
+            if holds_slot:
+                self.in_flight -= 1
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
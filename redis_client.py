@@ -0,0 +1,149 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Set
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+# Python twins of the Lua scripts passed to eval(), by script text, so that
+# FakeRedis can run them. A twin is called as twin(client, keys, args) and
+# reaches the data through the client's sync methods, as the script does
+# through redis.call().
+_scripts: Dict[str, Callable] = {}
+_clients: Dict[str, object] = {}
+
+
+def register(script: str, twin: Callable):
+    _scripts[script] = twin
+
+
+def connect(url: str, setting: str):
+    # One client per URL, so the response cache, rate limiter and event broker
+    # share a connection pool when they point at the same server. "fake://..."
+    # is a FakeRedis; settings naming the same one share its data.
+    if url not in _clients:
+        if url.startswith("fake://"):
+            _clients[url] = FakeRedis()
+        elif redis is None:
+            raise RuntimeError(f"{setting} is set but the redis package is not installed")
+        else:
+            _clients[url] = redis.from_url(url)
+    return _clients[url]
+
+
+def _bytes(value) -> bytes:
+    # What a server hands back for a value it was given.
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode()
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class FakeRedis:
+    # The subset of the redis.asyncio client this app uses, kept in memory.
+    # Values come back as bytes, as from a real server. `clock` stands in for
+    # the server's time, for expiry and the TIME command.
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._data = {}
+        self._channels: Dict[str, Set["FakePubSub"]] = defaultdict(set)
+
+    def _live(self, name: str):
+        entry = self._data.get(name)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[name]
+            return None
+        return value
+
+    async def get(self, name: str):
+        return self._live(name)
+
+    async def set(self, name: str, value, ex: Optional[int] = None):
+        self._data[name] = (_bytes(value), self.clock() + ex if ex else None)
+        return True
+
+    async def publish(self, channel: str, message) -> int:
+        subscribers = list(self._channels.get(_text(channel), ()))
+        for pubsub in subscribers:
+            pubsub.deliver(_text(channel), _bytes(message))
+        return len(subscribers)
+
+    def pubsub(self) -> "FakePubSub":
+        return FakePubSub(self)
+
+    async def eval(self, script: str, numkeys: int, *keys_and_args):
+        keys = [_text(key) for key in keys_and_args[:numkeys]]
+        args = [_bytes(arg) for arg in keys_and_args[numkeys:]]
+        return _bytes(_scripts[script](self, keys, args))
+
+    # Commands for script twins, which run synchronously like Lua does.
+
+    def time(self):
+        now = self.clock()
+        seconds = int(now)
+        return [seconds, int(round((now - seconds) * 1000000))]
+
+    def hmget(self, name: str, *fields):
+        values = self._live(name) or {}
+        return [values.get(field) for field in fields]
+
+    def hset(self, name: str, mapping: dict):
+        values = self._live(name)
+        if values is None:
+            values = {}
+            self._data[name] = (values, None)
+        values.update((field, _bytes(value)) for field, value in mapping.items())
+
+    def expire(self, name: str, seconds: float):
+        values = self._live(name)
+        if values is not None:
+            self._data[name] = (values, self.clock() + seconds)
+
+
+class FakePubSub:
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.channels: Set[str] = set()
+        # Made on first use, inside the running loop the reader waits on.
+        self._messages: Optional[asyncio.Queue] = None
+
+    def _queue(self) -> asyncio.Queue:
+        if self._messages is None:
+            self._messages = asyncio.Queue()
+        return self._messages
+
+    def deliver(self, channel: str, data: bytes):
+        self._queue().put_nowait({"type": "message", "pattern": None, "channel": channel.encode(), "data": data})
+
+    async def subscribe(self, *channels):
+        for channel in map(_text, channels):
+            self.channels.add(channel)
+            self.client._channels[channel].add(self)
+
+    async def unsubscribe(self, *channels):
+        for channel in map(_text, channels or list(self.channels)):
+            self.channels.discard(channel)
+            self.client._channels[channel].discard(self)
+            if not self.client._channels[channel]:
+                del self.client._channels[channel]
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: float = 0.0):
+        try:
+            return await asyncio.wait_for(self._queue().get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        await self.unsubscribe()
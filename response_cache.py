@@ -0,0 +1,152 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import lru_cache
+from typing import Awaitable, Callable, Iterable, Optional
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+import redis_client
+
+# Unset keeps the cache in process; "redis://..." shares it between workers
+# and "fake://..." uses redis_client.FakeRedis, an in-memory stand-in for
+# tests.
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+# Invalidation only reaches the process that made the change (or ran the
+# job), so with several workers an in-process cache is stale elsewhere;
+# its responses are kept this long at most. Share a backend to cache longer.
+RESPONSE_CACHE_LOCAL_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_LOCAL_TTL_SECONDS", "5"))
+
+TODOS = "todos"
+JOINED_GROUPS = "groups.joined"
+CALENDAR = "calendar"
+
+
+class LocalCacheBackend:
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, max_ttl: int = RESPONSE_CACHE_LOCAL_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value, ttl: Optional[int] = None):
+        if ttl:
+            ttl = min(ttl, self.max_ttl)
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class RedisCacheBackend:
+    def __init__(self, client):
+        self.client = client
+
+    async def get(self, key: str):
+        return await self.client.get(key)
+
+    async def set(self, key: str, value, ttl: Optional[int] = None):
+        await self.client.set(key, value, ex=ttl)
+
+
+def make_backend(url: Optional[str] = RESPONSE_CACHE_URL):
+    if not url:
+        return LocalCacheBackend()
+    return RedisCacheBackend(redis_client.connect(url, "RESPONSE_CACHE_URL"))
+
+
+backend = make_backend()
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def _version(resource: str, user_id: int) -> str:
+    # Every (resource, user) has an opaque version that is part of its cache
+    # keys; invalidating replaces it, which orphans all cached variants at
+    # once. A version lost to eviction is simply replaced, never reused.
+    key = f"version:{resource}:{user_id}"
+    version = await backend.get(key)
+    if version is None:
+        version = secrets.token_hex(8)
+        await backend.set(key, version)
+    return _decode(version)
+
+
+async def invalidate(resources: Iterable[str], user_ids: Iterable[int]):
+    for user_id in set(user_ids):
+        for resource in resources:
+            await backend.set(f"version:{resource}:{user_id}", secrets.token_hex(8))
+
+
+@lru_cache(maxsize=None)
+def _adapter(response_model) -> TypeAdapter:
+    return TypeAdapter(response_model)
+
+
+def render(response_model, content) -> bytes:
+    # Validates ORM objects against the response model the way FastAPI does
+    # and serializes straight to JSON bytes.
+    adapter = _adapter(response_model)
+    return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison, as RFC 9110 asks for If-None-Match.
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+async def respond(request: Request, resource: str, user_id: int, build: Callable[[], Awaitable[bytes]],
+                  today: Optional[date] = None) -> Response:
+    # Serves `resource` for `user_id` from the cache, calling `build` for the
+    # JSON body on a miss. The version is read before `build` touches the
+    # database, so a write that commits in between leaves this render under a
+    # key nobody will look up again. Resources that change when the user's
+    # local day does pass `today`, so no worker serves yesterday's render
+    # after midnight, whether or not the rollover's invalidation reached it.
+    query = urlencode(sorted(request.query_params.multi_items()))
+    day = today.isoformat() if today is not None else ""
+    key = f"response:{resource}:{user_id}:{await _version(resource, user_id)}:{day}:{query}"
+    entry = await backend.get(key)
+    if entry is None:
+        body = await build()
+        etag = _etag(body)
+        await backend.set(key, etag.encode() + b"\n" + body, RESPONSE_CACHE_TTL_SECONDS)
+    else:
+        etag, body = entry.split(b"\n", 1)
+        etag = etag.decode()
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
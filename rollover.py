@@ -0,0 +1,105 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+
+import calendar_status
+import models
+import queries
+import sync
+import timezones
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ROLLOVER_BATCH_SIZE = int(os.getenv("ROLLOVER_BATCH_SIZE", "500"))
+
+
+@dataclass
+class BatchReport:
+    timezone: str
+    today: date
+    batch: int
+    user_ids: List[int]
+    rows: int
+    duration: float
+
+
+def _roll_over_users(db: Session, user_ids: List[int], today: date) -> int:
+    # Completions are logged per day, so nothing needs resetting; expired
+    # todos go, with their completions, and the calendar is finalized. Sync
+    # clients are told about both the deletions and the todos whose
+    # `completed` just turned false. Those are collected first and stamped
+    # last, so the sync clock stays locked only for the two statements that
+    # carry its version, not for the whole batch.
+    expired = db.execute(queries.expired_todos(user_ids, today, models.Todo.creator_id, models.Todo.id)).all()
+    stale = db.execute(queries.completed_since_rollover(user_ids, today)).scalars().all()
+    db.execute(
+        delete(queries.completions)
+        .where(queries.completions.c.todo_id.in_(queries.expired_todos(user_ids, today)))
+    )
+    deleted = db.execute(
+        delete(models.Todo)
+        .where(models.Todo.creator_id.in_(user_ids), models.Todo.end_date < today)
+        .execution_options(synchronize_session=False)
+    )
+    finalized = calendar_status.finalize_day(db, today, user_ids)
+    db.execute(
+        update(models.User)
+        .where(models.User.id.in_(user_ids))
+        .values(rolled_over_on=today)
+        .execution_options(synchronize_session=False)
+    )
+    if expired or stale:
+        version = sync.next_version(db)
+        if expired:
+            db.execute(insert(sync.tombstones), [
+                {"user_id": user_id, "entity_id": todo_id, "version": version, "kind": sync.TODO}
+                for user_id, todo_id in expired
+            ])
+        if stale:
+            db.execute(update(models.Todo).where(models.Todo.id.in_(stale)).values(version=version))
+    return deleted.rowcount + finalized
+
+
+def roll_over(now: Optional[datetime] = None, batch_size: int = ROLLOVER_BATCH_SIZE) -> List[BatchReport]:
+    # Runs every few minutes. Each user is rolled over once their own local
+    # date has moved past rolled_over_on: expired todos are deleted and the
+    # calendar finalized. Users of one timezone are taken batch_size at a time,
+    # each batch in its own transaction, so the nightly work is spread across
+    # the day's timezones in bounded chunks, and a missed run is simply caught
+    # up by the next one.
+    now = now or datetime.now(timezone.utc)
+    reports = []
+    db = SessionLocal()
+    try:
+        for tz_name in db.execute(queries.user_timezones()).scalars().all():
+            today = timezones.today_in(tz_name, now)
+            while True:
+                started = time.perf_counter()
+                user_ids = db.execute(queries.users_due_for_rollover(tz_name, today, batch_size)).scalars().all()
+                if not user_ids:
+                    break
+                rows = _roll_over_users(db, user_ids, today)
+                db.commit()
+                report = BatchReport(
+                    timezone=tz_name,
+                    today=today,
+                    batch=len(reports) + 1,
+                    user_ids=user_ids,
+                    rows=rows,
+                    duration=time.perf_counter() - started,
+                )
+                reports.append(report)
+                logger.info(
+                    "rollover batch %d: %d users in %s to %s, %d rows in %.3fs",
+                    report.batch, len(user_ids), tz_name, today, report.rows, report.duration,
+                )
+    finally:
+        db.close()
+    return reports
@@ -1,16 +1,27 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 from typing import List, Optional
 from datetime import date
 
+import timezones
+
 
 class UserBase(BaseModel):
     username: str
 
 
+def _check_timezone(value):
+    if value is not None and not timezones.is_valid(value):
+        raise ValueError("unknown timezone")
+    return value
+
+
 class UserCreate(UserBase):
     password: str
+    timezone: Optional[str] = None
     # profile: Optional[str] = None
 
+    _timezone = validator("timezone", allow_reuse=True)(_check_timezone)
+
 
 class User(UserBase):
     id: int
@@ -20,6 +31,12 @@ class User(UserBase):
         orm_mode = True
 
 
+class UserTimezone(BaseModel):
+    timezone: str
+
+    _timezone = validator("timezone", allow_reuse=True)(_check_timezone)
+
+
 class TokenRequest(BaseModel):
     username: str
     password: str
@@ -50,6 +67,23 @@ class Todo(TodoBase):
         orm_mode = True
 
 
+class TodoCompletion(BaseModel):
+    id: int
+    completed: bool = False
+
+
+class TodoBatchResult(BaseModel):
+    index: int
+    ok: bool
+    todo: Optional[Todo] = None
+    error: Optional[str] = None
+
+
+class TodoPage(BaseModel):
+    items: List[Todo]
+    next_cursor: Optional[str] = None
+
+
 class GroupBase(BaseModel):
     name: str
 
@@ -67,6 +101,44 @@ class Group(GroupBase):
         orm_mode = True
 
 
+class SyncChanges(BaseModel):
+    version: int
+    todos: List[Todo]
+    groups: List[Group]
+    deleted_todos: List[int]
+    deleted_groups: List[int]
+
+
+class MemberProgress(BaseModel):
+    user_id: int
+    username: str
+    completed: int
+    missed: int
+    open: int
+    streak: int
+
+    class Config:
+        orm_mode = True
+
+
+class GroupProgress(BaseModel):
+    group_id: int
+    start: date
+    end: date
+    snapshot: bool
+    members: List[MemberProgress]
+
+
+class GroupPage(BaseModel):
+    items: List[Group]
+    next_cursor: Optional[str] = None
+
+
+class UserPage(BaseModel):
+    items: List[User]
+    next_cursor: Optional[str] = None
+
+
 class CalendarStatus(BaseModel):
     date: date
     status: str
@@ -0,0 +1,35 @@
+from collections import defaultdict
+
+import orjson
+from fastapi import Response
+
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content)
+
+
+def rows(items) -> list:
+    # Rows selected with queries.*_COLUMNS already carry the schema's field
+    # names in field order, so they map straight onto the JSON objects.
+    return [row._asdict() for row in items]
+
+
+def page(result: dict, items=None) -> dict:
+    return {"items": rows(result["items"]) if items is None else items, "next_cursor": result["next_cursor"]}
+
+
+def groups(group_rows, member_rows) -> list:
+    members = defaultdict(list)
+    for member in member_rows:
+        members[member.group_id].append({"username": member.username, "id": member.id})
+    return [
+        {"name": group.name, "id": group.id, "creator_id": group.creator_id, "members": members[group.id]}
+        for group in group_rows
+    ]
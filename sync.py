@@ -0,0 +1,39 @@
+from typing import Iterable
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+import models
+from database import insert_missing
+
+TODO = "todo"
+GROUP = "group"
+
+clock = models.SyncClock.__table__
+tombstones = models.SyncTombstone.__table__
+
+
+def next_version(db: Session) -> int:
+    # Call it as late as possible before committing: the clock row stays
+    # locked until then, so versions become visible in the order they were
+    # handed out and a client that has seen version n never misses a change
+    # stamped below n.
+    bump = update(clock).where(clock.c.id == 1).values(version=clock.c.version + 1)
+    if not db.execute(bump).rowcount:
+        # The first version ever; another request may be seeding it too.
+        insert_missing(db, clock, [{"id": 1, "version": 0}])
+        db.execute(bump)
+    return db.execute(select(clock.c.version).where(clock.c.id == 1)).scalar_one()
+
+
+def stamp(db: Session, *rows) -> int:
+    version = next_version(db)
+    for row in rows:
+        row.version = version
+    return version
+
+
+def bury(db: Session, version: int, kind: str, entity_id: int, user_ids: Iterable[int]):
+    rows = [{"user_id": user_id, "version": version, "kind": kind, "entity_id": entity_id} for user_id in user_ids]
+    if rows:
+        db.execute(insert(tombstones), rows)
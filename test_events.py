@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import events
+import redis_client
+
+
+def _brokers(kind: str):
+    # One broker per worker, as each process would make for itself.
+    if kind == "local":
+        broker = events.LocalBroker()
+        return broker, broker
+    client = redis_client.FakeRedis()
+    return events.RedisBroker(client), events.RedisBroker(client)
+
+
+async def _next(subscription: events.Subscription):
+    return await asyncio.wait_for(subscription.queue.get(), 2)
+
+
+@pytest.fixture(params=["local", "fake"])
+def kind(request):
+    return request.param
+
+
+def test_events_reach_subscribers_on_every_worker(kind):
+    async def run():
+        first, second = (events.Hub(broker) for broker in _brokers(kind))
+        here = await first.subscribe("group:1", 1)
+        there = await second.subscribe("group:1", 2)
+        elsewhere = await second.subscribe("group:2", 3)
+        await first.publish("group:1", {"type": events.PROGRESS, "user_id": 1})
+        frames = await _next(here), await _next(there)
+        await first.close()
+        await second.close()
+        return frames, elsewhere.queue.empty()
+
+    frames, untouched = asyncio.run(run())
+    assert frames == (b'event: progress\ndata: {"type":"progress","user_id":1}\n\n',) * 2
+    assert untouched
+
+
+def test_leaving_ends_only_the_leavers_stream(kind):
+    async def run():
+        hub = events.Hub(_brokers(kind)[0])
+        leaver = await hub.subscribe("group:1", 1)
+        stayer = await hub.subscribe("group:1", 2)
+        await hub.publish("group:1", {"type": events.MEMBER_LEFT, "group_id": 1, "user_id": 1})
+        leaver_frames = [await _next(leaver), await _next(leaver)]
+        stayer_frame = await _next(stayer)
+        await hub.close()
+        return leaver_frames, stayer_frame, stayer.queue.empty()
+
+    leaver_frames, stayer_frame, stayer_done = asyncio.run(run())
+    assert leaver_frames[0].startswith(b"event: member_left") and leaver_frames[1] is events.CLOSE
+    assert stayer_frame.startswith(b"event: member_left") and stayer_done
+
+
+def test_a_slow_subscriber_is_told_to_resync(kind):
+    async def run():
+        hub = events.Hub(_brokers(kind)[0], queue_size=2)
+        slow = await hub.subscribe("group:1", 1)
+        for i in range(3):
+            await hub.publish("group:1", {"type": events.PROGRESS, "i": i})
+        await asyncio.sleep(0.05)
+        frames = [slow.queue.get_nowait() for _ in range(slow.queue.qsize())]
+        await hub.close()
+        return frames, slow.closed
+
+    assert asyncio.run(run()) == ([events.RESYNC], True)
+
+
+def test_stream_ends_when_the_group_is_deleted(kind):
+    async def run():
+        hub = events.Hub(_brokers(kind)[0])
+        stream = hub.stream("group:1", 1)
+        frames = [await stream.__anext__()]
+
+        async def read():
+            async for frame in stream:
+                frames.append(frame)
+
+        reader = asyncio.create_task(read())
+        await hub.publish("group:1", {"type": events.GROUP_DELETED, "group_id": 1})
+        await asyncio.wait_for(reader, 2)
+        await hub.close()
+        return frames, hub._subscriptions
+
+    frames, subscriptions = asyncio.run(run())
+    assert frames == [
+        b"event: ready\ndata: {}\n\n",
+        b'event: group_deleted\ndata: {"type":"group_deleted","group_id":1}\n\n',
+    ]
+    assert not subscriptions
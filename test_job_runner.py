@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import select
+
+import job_runner
+import models
+from database import SessionLocal
+
+TRIGGER = CronTrigger(hour=1, minute=0, timezone="UTC")
+FIRED = datetime(2026, 10, 17, 1, 0, 2, tzinfo=timezone.utc)
+
+
+def _runs(lock):
+    if isinstance(lock, job_runner.LocalJobLock):
+        return [(run["status"], run["rows"], run["error"]) for run in lock.runs]
+    with SessionLocal() as db:
+        return db.execute(select(models.JobRun.status, models.JobRun.rows, models.JobRun.error)).all()
+
+
+@pytest.fixture(params=sorted(job_runner.LOCK_BACKENDS))
+def lock(request):
+    return job_runner.make_lock(request.param)
+
+
+def test_only_one_worker_runs_each_firing(lock):
+    calls = []
+
+    async def job():
+        calls.append(1)
+        return 3
+
+    async def run():
+        # Three workers whose timers fired a little apart.
+        runners = [job_runner.JobRunner(lock) for _ in range(3)]
+        return await asyncio.gather(*(
+            runner.run_once("refresh", job, TRIGGER, rows=lambda rows: rows, now=FIRED.replace(second=second))
+            for runner, second in zip(runners, (2, 5, 40))
+        ))
+
+    results = asyncio.run(run())
+    assert sorted(results, key=str) == [3, None, None]
+    assert len(calls) == 1
+    assert [(status, rows) for status, rows, _ in _runs(lock)] == [(job_runner.SUCCEEDED, 3)]
+
+
+def test_the_next_firing_is_claimed_again(lock):
+    async def job():
+        return 0
+
+    async def run():
+        runner = job_runner.JobRunner(lock)
+        await runner.run_once("refresh", job, TRIGGER, now=FIRED)
+        return await runner.run_once("refresh", job, TRIGGER, now=FIRED.replace(day=18))
+
+    assert asyncio.run(run()) == 0
+    assert len(_runs(lock)) == 2
+
+
+def test_a_failed_run_is_recorded(lock):
+    async def job():
+        raise RuntimeError("boom")
+
+    assert asyncio.run(job_runner.JobRunner(lock).run_once("refresh", job, TRIGGER, now=FIRED)) is None
+    [(status, rows, error)] = _runs(lock)
+    assert status == job_runner.FAILED and "boom" in error
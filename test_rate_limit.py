@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+
+import rate_limit
+import redis_client
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+# (seconds since the previous request, client, cost). Steps are multiples of
+# 1/4 s so every level is exact in Lua's 14 significant digits too.
+REQUESTS = [
+    (0, "a", 1), (0, "a", 3), (0, "a", 1), (0, "a", 1), (0, "b", 10),
+    (0.25, "a", 1), (0.5, "a", 2), (0, "b", 1), (1.5, "a", 5), (0, "a", 1),
+    (10, "a", 1), (0.25, "b", 4), (0, "b", 4), (3, "b", 4),
+]
+
+
+def _waits(backend, clock: Clock):
+    async def run():
+        waits = []
+        for step, key, cost in REQUESTS:
+            clock.now += step
+            waits.append(await backend.take(key, cost, 2.0, 5.0))
+        return waits
+
+    return asyncio.run(run())
+
+
+def test_token_bucket_script_matches_local_backend():
+    local_clock, redis_clock = Clock(1000.0), Clock(1700000000.0)
+    local = _waits(rate_limit.LocalRateBackend(clock=local_clock), local_clock)
+    shared = _waits(rate_limit.RedisRateBackend(redis_client.FakeRedis(clock=redis_clock)), redis_clock)
+    assert shared == local
+    assert any(local) and not all(local)
+
+
+def test_token_bucket_script_expires_idle_buckets():
+    clock = Clock(1700000000.0)
+    client = redis_client.FakeRedis(clock=clock)
+    backend = rate_limit.RedisRateBackend(client)
+    asyncio.run(backend.take("a", 1, 2.0, 5.0))
+    assert client.hmget("ratelimit:a", "tokens") == [b"4"]
+    clock.now += 4
+    assert client.hmget("ratelimit:a", "tokens") == [None]
+
+
+def test_middleware_answers_429_once_the_burst_is_spent():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = rate_limit.RateLimitMiddleware(app, backend=rate_limit.LocalRateBackend(clock=Clock(0.0)))
+
+    async def run():
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.get("/todo") for _ in range(int(rate_limit.RATE_LIMIT_IP_BURST) + 1)]
+
+    responses = asyncio.run(run())
+    assert all(response.status_code == 200 for response in responses[:-1])
+    assert responses[-1].status_code == 429
+    assert int(responses[-1].headers["Retry-After"]) >= 1
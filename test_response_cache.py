@@ -0,0 +1,114 @@
+import asyncio
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from starlette.requests import Request
+
+import redis_client
+import response_cache
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _request(query: bytes = b"", etag: str = None) -> Request:
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": "/todo", "query_string": query, "headers": headers})
+
+
+@pytest.fixture(params=["local", "fake"])
+def backend(request, monkeypatch):
+    if request.param == "local":
+        backend = response_cache.LocalCacheBackend()
+    else:
+        backend = response_cache.RedisCacheBackend(redis_client.FakeRedis())
+    monkeypatch.setattr(response_cache, "backend", backend)
+    return backend
+
+
+def test_responses_are_served_from_cache_until_invalidated(backend):
+    builds = []
+
+    async def build():
+        builds.append(1)
+        return b'{"n":%d}' % len(builds)
+
+    async def run():
+        first = await response_cache.respond(_request(), response_cache.TODOS, 1, build)
+        second = await response_cache.respond(_request(), response_cache.TODOS, 1, build)
+        other_user = await response_cache.respond(_request(), response_cache.TODOS, 2, build)
+        await response_cache.invalidate((response_cache.TODOS,), [1])
+        third = await response_cache.respond(_request(), response_cache.TODOS, 1, build)
+        return first, second, other_user, third
+
+    first, second, other_user, third = asyncio.run(run())
+    assert first.body == second.body == b'{"n":1}'
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert other_user.body == b'{"n":2}'
+    assert third.body == b'{"n":3}'
+
+
+def test_query_and_local_day_are_part_of_the_key(backend):
+    builds = []
+
+    async def build():
+        builds.append(1)
+        return b"[]"
+
+    async def run():
+        for query, today in ((b"limit=5", 17), (b"limit=5", 17), (b"limit=6", 17), (b"limit=5", 18)):
+            await response_cache.respond(_request(query), response_cache.CALENDAR, 1, build, date(2026, 10, today))
+
+    asyncio.run(run())
+    assert len(builds) == 3
+
+
+def test_matching_etag_gets_304(backend):
+    async def build():
+        return b"[1]"
+
+    async def run():
+        first = await response_cache.respond(_request(), response_cache.TODOS, 1, build)
+        etag = f'W/{first.headers["ETag"]}'
+        return first, await response_cache.respond(_request(etag=etag), response_cache.TODOS, 1, build)
+
+    first, second = asyncio.run(run())
+    assert second.status_code == 304
+    assert second.body == b""
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+
+def test_local_backend_keeps_entries_briefly_and_evicts_the_oldest(monkeypatch):
+    clock = Clock(1000.0)
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(time=clock))
+    backend = response_cache.LocalCacheBackend(maxsize=2, max_ttl=5)
+
+    async def run():
+        await backend.set("a", b"1", 300)
+        await backend.set("b", b"2")
+        clock.now += 6
+        expired = await backend.get("a")
+        await backend.set("c", b"3")
+        await backend.set("d", b"4")
+        return expired, await backend.get("b"), await backend.get("c"), await backend.get("d")
+
+    assert asyncio.run(run()) == (None, None, b"3", b"4")
+
+
+def test_fake_redis_expires_values():
+    clock = Clock(1000.0)
+    client = redis_client.FakeRedis(clock=clock)
+
+    async def run():
+        await client.set("a", "1", ex=10)
+        kept = await client.get("a")
+        clock.now += 10
+        return kept, await client.get("a")
+
+    assert asyncio.run(run()) == (b"1", None)
@@ -0,0 +1,25 @@
+import argparse
+import asyncio
+
+import bench
+
+
+def _bench_args(**options) -> argparse.Namespace:
+    args = argparse.Namespace(
+        users=4, todos_per_user=30, groups=3, members_per_group=3, requests=1, concurrency=4, seed=0, only=None,
+        verify_serialization=False, verify_concurrency=False,
+    )
+    vars(args).update(options)
+    return args
+
+
+def test_list_endpoints_match_the_pydantic_rendering_byte_for_byte():
+    args = _bench_args(verify_serialization=True)
+    asyncio.run(bench.run(args))
+    assert args.mismatches == []
+
+
+def test_simultaneous_writes_all_succeed_and_keep_the_calendar_right():
+    args = _bench_args(verify_concurrency=True)
+    asyncio.run(bench.run(args))
+    assert args.mismatches == []